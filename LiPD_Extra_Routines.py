@@ -3,8 +3,19 @@
 #==============================================================================
 # Extra LiPD routines:
 #
-#   Read_JSON         - Read metadata and return JSON structure
+#   Read_JSON         - Read metadata and return JSON structure (cached)
+#   Read_Columns      - Return year/age and dataset column indices (cached)
+#   Read_JSON_Columns - Read_JSON and Read_Columns in one cache lookup
+#   Read_JSON_Direct  - Read metadata and return JSON structure (no cache)
+#   Find_Columns      - Find year/age and dataset columns in measurement table
 #   Read_CSV2DF       - Read internal CSV file and return dataframe
+#   List_Bag          - List files inside LiPD file
+#   Read_LiPD_List    - Read proxy list file (LiPD file names)
+#   List_LiPD_Source  - List dataset names in a data source
+#   Iter_LiPD_Source  - Iterate over datasets in a data source
+#   SubStream         - Read-only seekable window onto part of a file
+#   Set_Cache         - Configure the metadata cache
+#   Cache_Stats       - Return metadata cache hit/miss statistics
 #   print_nested_dict - Print LiPD structure to screen
 #   write_nested_dict - Write LiPD structure to file
 #   extract_values    - Extract data from complex JSON
@@ -12,6 +23,20 @@
 #
 #------------------------------------------------------------------------------
 # Notes:
+#   - Only Read_CSV2DF needs pandas, which is imported on first use.
+#   - Read_JSON/Read_Columns/Read_JSON_Columns go through a two-level metadata cache: an
+#     in-process LRU and (if Set_Cache is given a folder) a size-bounded LRU
+#     on disk.  Entries hold the parsed metadata and the resolved column
+#     indices, pickled and zlib-compressed, keyed by path, size, mtime and
+#     optionally an MD5 of the file.  Cached metadata is shared between
+#     callers, so treat it as read-only.  Only use a trusted cache folder
+#     (entries are unpickled).
+#   - A data source is a proxy list file, a folder of .lpd files, a single
+#     .lpd file, or a zip/tar bundle of .lpd files.  Bundle members are
+#     passed on as seekable streams (no temporary files): stored zip
+#     members and members of uncompressed tars are read in place through a
+#     SubStream, others are inflated into memory.  The LiPD routines above
+#     accept these streams as well as file names.
 #
 #------------------------------------------------------------------------------
 # By John Vitkovsky
@@ -23,22 +48,70 @@
 
 # Modules:
 import sys, os
-import numpy as np
-import pandas as pd
 from zipfile import ZipFile
+import zipfile, tarfile
+import struct
+import io
 import json
+import pickle, zlib, hashlib
+from collections import OrderedDict
 
 
 # Variables:
 DEBUG = 0  # 0=None, 1=Some, 2=More
 
+# Metadata cache (see Set_Cache):
+CACHE_VERSION = 1  # Bump when the cache entry format changes
+CACHE_DIR = None  # Disk cache folder (None = in-process cache only)
+CACHE_MAX_BYTES = 64 * 1024**2  # Disk cache size limit
+CACHE_HASH = False  # Also key on MD5 of the LiPD file
+CACHE_MEM_ITEMS = 1024  # In-process cache size (entries)
+cache_mem = OrderedDict()  # In-process LRU (key -> entry)
+cache_disk_bytes = None  # Disk cache size (None = not scanned yet)
+cache_stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
 
 
 
 #------------------------------------------------------------------------------
 # Read metadata and return JSON structure
+#   - Cached (see Read_Cached); treat the result as read-only.
 #------------------------------------------------------------------------------
 def Read_JSON(lipd_file):
+    return Read_Cached(lipd_file)['meta']
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Return (year/age column, dataset column) indices of measurement table #1
+#   - Cached (see Read_Cached); either index is None if not found.
+#------------------------------------------------------------------------------
+def Read_Columns(lipd_file):
+    return Read_Cached(lipd_file)['columns']
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Return (JSON structure, year/age column, dataset column)
+#   - One cache lookup (see Read_Cached), so a file is counted and keyed
+#     once rather than once each by Read_JSON and Read_Columns.
+#------------------------------------------------------------------------------
+def Read_JSON_Columns(lipd_file):
+    entry = Read_Cached(lipd_file)
+    return (entry['meta'],) + tuple(entry['columns'])
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Read metadata and return JSON structure (no cache)
+#------------------------------------------------------------------------------
+def Read_JSON_Direct(lipd_file):
     zf = ZipFile(lipd_file)
     with zf.open('bag/data/metadata.jsonld') as f:  
         # jf = json.loads(f.read())
@@ -55,10 +128,63 @@ def Read_JSON(lipd_file):
 
 
 
+#------------------------------------------------------------------------------
+# Find first "year" or "age" column and the dataset column
+#   - Returns (x_col_1, x_col_2); either is None if not found.
+#------------------------------------------------------------------------------
+def Find_Columns(LTab):
+
+    LTab_columns = len(LTab['columns'])
+
+    # Find first "year" or "age" column:
+    x_col_1 = None
+    # ---Try to find "YEAR CE/BCE"---
+    for i in range(LTab_columns):
+        stmp = extract_string1(LTab['columns'][i], 'variableName', False, 'NA')
+        if stmp.split(' ')[0].upper() == 'YEAR':
+            x_col_1 = i
+            break
+        # end if
+    # end for
+    # ---Else try to find "AGE"---
+    if x_col_1 == None:
+        for i in range(LTab_columns):
+            stmp = extract_string1(LTab['columns'][i], 'variableName', False, 'NA')
+            if stmp.split(' ')[0].upper() == 'AGE':
+                x_col_1 = i
+                break
+            # end if
+        # end for
+    # end if
+
+    # Find dataset column (first with "variableType" = PROXY or RECONSTRUCTION):
+    x_col_2 = None
+    # ---First "variableType" with PROXY or RECONSTRUCTION---
+    # for i in range(LTab_columns):
+    #     stmp = extract_string1(LTab['columns'][i], 'variableType', False, 'NA')
+    #     if stmp.upper() in ['PROXY', 'RECONSTRUCTION']:
+    #         x_col_2 = i
+    #         break
+    #     # end if
+    # # end for
+    # ---Use specific column---
+    # x_col_2 = LTab_columns - 1  # Use last column
+    if LTab_columns >= 2:
+        x_col_2 = LTab_columns - 2  # Use 2nd last column (last is QC)
+    # end if
+
+    return x_col_1, x_col_2
+
+# end def
+
+
+
+
 #------------------------------------------------------------------------------
 # Read internal CSV file and return dataframe
 #------------------------------------------------------------------------------
 def Read_CSV2DF(lipd_file, csv_file):
+    import pandas as pd
     zf = ZipFile(lipd_file)
     # df = pd.read_csv(zf.open('bag/data/' + csv_file))
     # There are no column names in LiPD CSVs.
@@ -69,6 +195,480 @@ def Read_CSV2DF(lipd_file, csv_file):
 
 
 
+#------------------------------------------------------------------------------
+# List files inside LiPD file
+#------------------------------------------------------------------------------
+def List_Bag(lipd_file):
+    zf = ZipFile(lipd_file)
+    return zf.namelist()
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Read proxy list file
+#   - Returns LiPD file names, skipping blank and comment ("#") lines.
+#------------------------------------------------------------------------------
+def Read_LiPD_List(list_file):
+
+    names = []
+    with open(list_file, 'r') as f:
+        for i in f:
+            if i.strip() != '' and i.strip()[0] != '#':
+                names.append(i.strip())
+            # end if
+        # end for
+    # end with
+    return names
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Data source type: 'folder', 'lipd', 'zip', 'tar' or 'list'
+#   - A missing source is a 'list' (reading it raises the OSError).
+#------------------------------------------------------------------------------
+def LiPD_Source_Type(source):
+
+    if os.path.isdir(source): return 'folder'
+    if not os.path.isfile(source): return 'list'
+    # Tar first: an uncompressed tar of .lpd files also looks like a zip file
+    if tarfile.is_tarfile(source): return 'tar'
+    if zipfile.is_zipfile(source):
+        with ZipFile(source) as zf:
+            if 'bag/data/metadata.jsonld' in zf.namelist(): return 'lipd'
+        # end with
+        return 'zip'
+    # end if
+    return 'list'
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# List dataset names in a data source (in source order)
+#   - Compressed tar bundles are decompressed once to list them.
+#------------------------------------------------------------------------------
+def List_LiPD_Source(source):
+
+    stype = LiPD_Source_Type(source)
+    if stype == 'folder':
+        return sorted([i for i in os.listdir(source) if i.lower().endswith('.lpd')])
+    elif stype == 'lipd':
+        return [os.path.basename(source)]
+    elif stype == 'zip':
+        with ZipFile(source) as zf:
+            return [i.filename for i in Zip_Members(zf)]
+        # end with
+    elif stype == 'tar':
+        with tarfile.open(source) as tf:
+            return [i.name for i in tf if Is_LiPD_Member(i)]
+        # end with
+    else:
+        return Read_LiPD_List(source)
+    # end if
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Iterate over datasets in a data source
+#   - Yields (name, lipd) in source order, where lipd is a file name
+#     (list/folder/single file) or a seekable stream (bundle member).
+#   - Bundles are read sequentially in one pass.  A member stream is only
+#     valid until the next dataset is requested.
+#------------------------------------------------------------------------------
+def Iter_LiPD_Source(source):
+
+    stype = LiPD_Source_Type(source)
+    if stype == 'folder':
+        for name in List_LiPD_Source(source):
+            yield name, os.path.join(source, name)
+        # end for
+    elif stype == 'lipd':
+        yield os.path.basename(source), source
+    elif stype == 'zip':
+        for item in Iter_Zip_Bundle(source):
+            yield item
+        # end for
+    elif stype == 'tar':
+        for item in Iter_Tar_Bundle(source):
+            yield item
+        # end for
+    else:
+        base = os.path.dirname(source)
+        for name in Read_LiPD_List(source):
+            yield name, os.path.join(base, name)
+        # end for
+    # end if
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Zip bundle members
+#   - Stored members are read in place (SubStream on the bundle file),
+#     compressed ones are inflated into memory.
+#------------------------------------------------------------------------------
+def Zip_Members(zf):
+    # .lpd members in file order
+    members = [i for i in zf.infolist() if i.filename.lower().endswith('.lpd') and not i.is_dir()]
+    return sorted(members, key=lambda i: i.header_offset)
+# end def
+
+
+def Iter_Zip_Bundle(bundle):
+
+    key = (CACHE_VERSION, os.path.abspath(bundle))
+    with open(bundle, 'rb') as f:
+        zf = ZipFile(f)
+        for info in Zip_Members(zf):
+            if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+                # Data follows the 30-byte local file header, file name and
+                # extra field (lengths at bytes 26-29, see the zip APPNOTE):
+                f.seek(info.header_offset)
+                header = f.read(30)
+                name_len, extra_len = struct.unpack('<HH', header[26:30])
+                start = info.header_offset + 30 + name_len + extra_len
+                stream = SubStream(f, start, info.file_size)
+            else:
+                stream = io.BytesIO(zf.read(info))
+            # end if
+            stream.cache_key = key + (info.filename, info.file_size, info.CRC)
+            yield info.filename, stream
+        # end for
+    # end with
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Tar bundle members
+#   - Uncompressed tars are read in place (SubStream on the bundle file),
+#     compressed ones are streamed and each member read into memory.
+#------------------------------------------------------------------------------
+def Is_LiPD_Member(info):
+    return info.isfile() and info.name.lower().endswith('.lpd')
+# end def
+
+
+def Iter_Tar_Bundle(bundle):
+
+    key = (CACHE_VERSION, os.path.abspath(bundle))
+    try:
+        tf = tarfile.open(bundle, 'r:')  # Uncompressed
+        compressed = False
+    except tarfile.ReadError:
+        tf = tarfile.open(bundle, 'r|*')  # Compressed, sequential stream
+        compressed = True
+    # end try
+    with tf:
+        for info in tf:
+            if not Is_LiPD_Member(info): continue
+            if compressed:
+                stream = io.BytesIO(tf.extractfile(info).read())
+            else:
+                stream = SubStream(tf.fileobj, info.offset_data, info.size)
+            # end if
+            stream.cache_key = key + (info.name, info.size, info.mtime)
+            yield info.name, stream
+        # end for
+    # end with
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Read-only seekable window onto part of a file
+#   - Several SubStreams can share one file object (each seeks before
+#     reading).
+#------------------------------------------------------------------------------
+class SubStream(io.RawIOBase):
+
+    def __init__(self, f, start, size):
+        self.f = f
+        self.start = start
+        self.size = size
+        self.pos = 0
+    # end def
+
+    def readable(self):
+        return True
+    # end def
+
+    def seekable(self):
+        return True
+    # end def
+
+    def tell(self):
+        return self.pos
+    # end def
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self.pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('Invalid whence: ' + str(whence))
+        # end if
+        if pos < 0: raise ValueError('Negative seek position: ' + str(pos))
+        self.pos = pos
+        return self.pos
+    # end def
+
+    def readinto(self, b):
+        n = max(0, min(len(b), self.size - self.pos))
+        if n == 0: return 0
+        self.f.seek(self.start + self.pos)
+        data = self.f.read(n)
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+    # end def
+
+# end class
+
+
+
+
+#------------------------------------------------------------------------------
+# Configure the metadata cache
+#   - cache_dir: disk cache folder (None = in-process cache only).
+#   - max_bytes: disk cache size limit (least recently used entries go first).
+#   - use_hash: also key entries on the MD5 of the LiPD file (catches edits
+#     that keep size and mtime, at the cost of reading each file).
+#   - mem_items: in-process cache size (entries).
+#------------------------------------------------------------------------------
+def Set_Cache(cache_dir=None, max_bytes=None, use_hash=None, mem_items=None):
+    global CACHE_DIR, CACHE_MAX_BYTES, CACHE_HASH, CACHE_MEM_ITEMS, cache_disk_bytes
+
+    CACHE_DIR = cache_dir
+    if CACHE_DIR is not None: os.makedirs(CACHE_DIR, exist_ok=True)
+    if max_bytes is not None: CACHE_MAX_BYTES = max_bytes
+    if use_hash is not None: CACHE_HASH = use_hash
+    if mem_items is not None: CACHE_MEM_ITEMS = mem_items
+    cache_disk_bytes = None  # Rescan on next write
+    while len(cache_mem) > CACHE_MEM_ITEMS:
+        cache_mem.popitem(last=False)
+    # end while
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Return metadata cache hit/miss statistics
+#------------------------------------------------------------------------------
+def Cache_Stats():
+    stats = dict(cache_stats)
+    lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+    if lookups > 0:
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups
+    else:
+        stats['hit_rate'] = 0.0
+    # end if
+    return stats
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Return cache entry {'meta': metadata, 'columns': (x_col_1, x_col_2)}
+#   - Looks in the in-process cache, then the disk cache, then reads the
+#     LiPD file.  File-like objects are read directly unless they have a
+#     "cache_key" attribute.
+#------------------------------------------------------------------------------
+def Read_Cached(lipd_file):
+
+    # Streams are cached only if they carry a cache_key (see Iter_LiPD_Source):
+    if isinstance(lipd_file, str):
+        key = Cache_Key(lipd_file)
+    else:
+        key = getattr(lipd_file, 'cache_key', None)
+        if key is None: return Make_Cache_Entry(lipd_file)
+    # end if
+
+    # In-process cache:
+    if key in cache_mem:
+        cache_mem.move_to_end(key)
+        cache_stats['memory_hits'] += 1
+        return cache_mem[key]
+    # end if
+
+    # Disk cache, else read LiPD file:
+    entry = None
+    if CACHE_DIR is not None: entry = Cache_Disk_Get(key)
+    if entry is not None:
+        cache_stats['disk_hits'] += 1
+    else:
+        cache_stats['misses'] += 1
+        entry = Make_Cache_Entry(lipd_file)
+        if CACHE_DIR is not None: Cache_Disk_Put(key, entry)
+    # end if
+
+    cache_mem[key] = entry
+    while len(cache_mem) > CACHE_MEM_ITEMS:
+        cache_mem.popitem(last=False)
+    # end while
+    return entry
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Read LiPD file into a cache entry
+#------------------------------------------------------------------------------
+def Make_Cache_Entry(lipd_file):
+
+    jf = Read_JSON_Direct(lipd_file)
+    try:
+        columns = Find_Columns(jf['paleoData'][0]['measurementTable'][0])
+    except (KeyError, IndexError, TypeError):
+        columns = (None, None)
+    # end try
+    return {'meta': jf, 'columns': columns}
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Cache key for a LiPD file (path, size, mtime and optional MD5)
+#------------------------------------------------------------------------------
+def Cache_Key(lipd_file):
+
+    st = os.stat(lipd_file)
+    md5 = None
+    if CACHE_HASH:
+        h = hashlib.md5()
+        with open(lipd_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+            # end for
+        # end with
+        md5 = h.hexdigest()
+    # end if
+    return (CACHE_VERSION, os.path.abspath(lipd_file), st.st_size, st.st_mtime_ns, md5)
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Disk cache get/put
+#   - One file per entry: zlib-compressed pickle of (key, entry).
+#   - Entry file mtime is the last use time (for LRU eviction).
+#------------------------------------------------------------------------------
+def Cache_Disk_File(key):
+    return os.path.join(CACHE_DIR, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.bin')
+# end def
+
+
+def Cache_Disk_Get(key):
+
+    file = Cache_Disk_File(key)
+    try:
+        with open(file, 'rb') as f:
+            stored_key, entry = pickle.loads(zlib.decompress(f.read()))
+        # end with
+        if stored_key != key: return None
+        os.utime(file)  # Mark as recently used
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # Unreadable entry, will be rewritten:
+        if DEBUG > 0: print('Bad cache entry', file, e)
+        return None
+    # end try
+    return entry
+
+# end def
+
+
+def Cache_Disk_Put(key, entry):
+    global cache_disk_bytes
+
+    file = Cache_Disk_File(key)
+    data = zlib.compress(pickle.dumps((key, entry), protocol=pickle.HIGHEST_PROTOCOL))
+    try:
+        with open(file + '.tmp', 'wb') as f:
+            f.write(data)
+        # end with
+        os.replace(file + '.tmp', file)  # Safe with several processes
+    except OSError as e:
+        if DEBUG > 0: print('Can\'t write cache entry', file, e)
+        return
+    # end try
+
+    # Evict least recently used entries when over size limit:
+    if cache_disk_bytes is None:
+        cache_disk_bytes = sum([i[1] for i in Cache_Disk_List()])
+    else:
+        cache_disk_bytes += len(data)
+    # end if
+    if cache_disk_bytes > CACHE_MAX_BYTES:
+        cache_disk_bytes = 0
+        keep = 0.9 * CACHE_MAX_BYTES  # Leave room so we don't evict on every write
+        full = False
+        for name, size, mtime in sorted(Cache_Disk_List(), key=lambda i: -i[2]):
+            full = full or (cache_disk_bytes + size > keep and name != file)
+            if not full:
+                cache_disk_bytes += size
+            else:
+                try:
+                    os.remove(name)
+                    cache_stats['evictions'] += 1
+                except OSError:
+                    pass
+                # end try
+            # end if
+        # end for
+    # end if
+
+# end def
+
+
+def Cache_Disk_List():
+    # Returns [(file, size, mtime)] of disk cache entries
+    entries = []
+    for i in os.scandir(CACHE_DIR):
+        if i.name.endswith('.bin'):
+            try:
+                st = i.stat()
+                entries.append((i.path, st.st_size, st.st_mtime))
+            except OSError:
+                pass
+            # end try
+        # end if
+    # end for
+    return entries
+# end def
+
+
+
+
 #------------------------------------------------------------------------------
 # Print LiPD structure to screen
 #   - Only for nested dictionaries.
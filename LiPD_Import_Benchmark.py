@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#==============================================================================
+# Import-time benchmark for the LiPD dashboard modules:
+#
+#   Times "import LiPD_Extra_Routines" and "import LiPD_Make_Dashboard_PDFs"
+#   in fresh interpreters and checks that no heavy module (numpy, pandas,
+#   matplotlib, cartopy, shapely, ReportLab, svglib) is loaded.  Optionally
+#   runs the lightweight --list/--validate/--dump modes on a data source
+#   and checks the same.  Exits with status 1 on a regression.
+#
+#   python LiPD_Import_Benchmark.py [--repeat N] [--budget SECONDS]
+#                                   [--source SOURCE] [--per-dataset SECONDS]
+#
+#------------------------------------------------------------------------------
+# Notes:
+#   - Times are measured inside the child interpreter, so they exclude
+#     Python start-up.  The median of the repeats is reported.
+#   - The mode cases read every dataset (with --no-cache), so their budget
+#     is --budget plus --per-dataset for each dataset in the source.
+#   - A mode that exits with an error status (e.g. --validate finding a
+#     bad file) is still timed; only the time and modules are checked.
+#
+#==============================================================================
+
+
+# Modules:
+import sys, os
+import argparse
+import json
+import subprocess
+
+
+# Variables:
+HEAVY_MODULES = ['numpy', 'pandas', 'matplotlib', 'cartopy', 'shapely',
+                 'reportlab', 'svglib', 'PIL']
+
+# Child script: run statement, report elapsed time and heavy modules loaded.
+CHILD = '''
+import sys, time, json, io, contextlib
+sys.path.insert(0, {path!r})
+t0 = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        {stmt}
+    except SystemExit:
+        pass
+t1 = time.perf_counter()
+print(json.dumps([t1 - t0, [m for m in {heavy!r} if m in sys.modules]]))
+'''
+
+
+#==============================================================================
+# MAIN
+#==============================================================================
+def main(argv):
+
+    parser = argparse.ArgumentParser(description='Import-time benchmark for the LiPD dashboard modules.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of fresh interpreters per case')
+    parser.add_argument('--budget', type=float, default=0.1,
+                        help='Maximum median time (s) for the import cases')
+    parser.add_argument('--source', default=None,
+                        help='Also benchmark the lightweight modes on this data source '
+                             '(proxy list, folder or bundle)')
+    parser.add_argument('--per-dataset', type=float, default=0.005,
+                        help='Extra time (s) allowed per dataset for the mode cases')
+    args = parser.parse_args(argv[1:])
+
+    # Benchmark cases (name, statement, budget):
+    cases = [('import LiPD_Extra_Routines', 'import LiPD_Extra_Routines', args.budget),
+             ('import LiPD_Make_Dashboard_PDFs', 'import LiPD_Make_Dashboard_PDFs', args.budget)]
+    if args.source is not None:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import LiPD_Extra_Routines as xlipd
+        num_datasets = len(xlipd.List_LiPD_Source(args.source))
+        mode_budget = args.budget + args.per_dataset * num_datasets
+        for mode in ['--list', '--validate', '--dump']:
+            stmt = ('import LiPD_Make_Dashboard_PDFs as m; m.main(["", "--no-cache", "--source", ' +
+                    repr(args.source) + ', "' + mode + '"])')
+            cases.append((mode + ' mode', stmt, mode_budget))
+        # end for
+    # end if
+
+    # Run cases:
+    print('\nImport-time benchmark (median of ' + str(args.repeat) +
+          ', budget ' + '%.3f' % args.budget + ' s', end='')
+    if args.source is not None:
+        print(', modes ' + '%.3f' % mode_budget + ' s for ' + str(num_datasets) + ' datasets', end='')
+    # end if
+    print('):')
+    num_bad = 0
+    for name, stmt, budget in cases:
+        elapsed, heavy = time_statement(stmt, args.repeat)
+        problems = []
+        if elapsed > budget: problems.append('over budget')
+        if len(heavy) > 0: problems.append('loaded ' + ', '.join(heavy))
+        if len(problems) == 0:
+            print('  OK    %7.3f s  %s' % (elapsed, name))
+        else:
+            print('  FAIL  %7.3f s  %s: %s' % (elapsed, name, '; '.join(problems)))
+            num_bad += 1
+        # end if
+    # end for
+
+    if num_bad > 0: sys.exit(1)
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Time a statement in fresh interpreters
+#   - Returns (median elapsed seconds, heavy modules loaded).
+#------------------------------------------------------------------------------
+def time_statement(stmt, repeat):
+
+    path = os.path.dirname(os.path.abspath(__file__))
+    code = CHILD.format(path=path, stmt=stmt, heavy=HEAVY_MODULES)
+    times = []
+    heavy = set()
+    for i in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], check=True,
+                             stdout=subprocess.PIPE, universal_newlines=True).stdout
+        t, h = json.loads(out.strip().splitlines()[-1])
+        times.append(t)
+        heavy.update(h)
+    # end for
+    times.sort()
+    return times[len(times) // 2], sorted(heavy)
+
+# end def
+
+
+
+
+# In case running from command-line:
+if __name__ == "__main__":
+    main(sys.argv)
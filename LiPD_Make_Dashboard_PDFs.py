@@ -3,8 +3,26 @@
 #==============================================================================
 # Routines for creating pdf/LiDP dashboard files:
 #
+#   main            - Render dashboards for all LiPD files in the proxy list
+#   build_panel     - Render one dataset into a reusable DashboardPanel
+#   draw_panel      - Draw a DashboardPanel onto a ReportLab canvas
+#   BookSink        - Output sink: combined book (two panels per page)
+#   DatasetPDFSink  - Output sink: one standalone PDF per dataset
+#   ThumbnailSink   - Output sink: one PNG thumbnail per dataset
+#   JSONSink        - Output sink: JSON sidecar of the extracted fields
+#
 #------------------------------------------------------------------------------
 # Notes:
+#   - Each dataset is rendered once into a DashboardPanel (metadata
+#     paragraphs, chart figure, map figure).  All output sinks consume the
+#     same panel, so an extra output format only costs its encoding time.
+#   - Sinks have begin(), add(panel) and end() methods.
+#   - Repeated PDF content (date header, panel border, charts and maps, and
+#     the map coastlines/gridlines for maps with the same centre) is stored
+#     once per PDF as a shared form XObject (see draw_shared).
+#   - Quality presets (--quality draft/standard/print, see QUALITY_PRESETS)
+#     set map detail, chart fidelity and PDF compression.  Pagination and
+#     metadata text are the same for all presets.
 #
 #------------------------------------------------------------------------------
 # By John Vitkovsky
@@ -14,44 +32,83 @@
 #==============================================================================
 
 
-# Modules: 
+# Modules:
 import sys, os
-import numpy as np
-import pandas as pd
 import datetime as dt
+import argparse
+import json
+import io
+import textwrap
+import time
+import hashlib
 
 # Graphics modules:
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-from matplotlib.lines import Line2D
-import cartopy.crs as ccrs
-import shapely
+#   - numpy, matplotlib, cartopy, shapely, ReportLab and svglib take seconds
+#     to import, so they are imported on first use inside the routines that
+#     need them.  The listing, validation and metadata dump modes never load
+#     them (see LiPD_Import_Benchmark.py).
+#import matplotlib.pyplot as plt
+#import cartopy.crs as ccrs
+#from reportlab.pdfgen import canvas
+#from svglib.svglib import svg2rlg
 
 # LiPD module:
 #import lipd
 import LiPD_Extra_Routines as xlipd
 
-# ReportLab module:
-import io
-from reportlab.pdfgen import canvas
-#from reportlab.lib.utils import ImageReader
-from reportlab.lib.pagesizes import A4, landscape, portrait
-from reportlab.lib.units import cm
-
-from reportlab.platypus import Paragraph, Table, TableStyle
-from reportlab.lib.styles import ParagraphStyle
-from reportlab.lib import colors
-
-from reportlab.pdfbase.pdfmetrics import stringWidth
-
-from reportlab.graphics import renderPDF
-from svglib.svglib import svg2rlg
-
-import textwrap
+# ReportLab units and page size (as reportlab.lib.units/pagesizes):
+inch = 72.0
+cm = inch / 2.54
+mm = cm * 0.1
+A4 = (210*mm, 297*mm)
 
 
 # Variables:
 DEBUG = 0  # 0=None, 1=Some, 2=More
+MAP_LEGEND_FLAG = False
+#BBOX_DX = 20.0  # Bounding box side in degrees
+#FIG_DPI = 300  # Figure DPI setting for PNG
+
+# Define colours:
+SOURCE_EC = (0.00, 0.00, 1.00)  # Marker/polygon edge colour
+SOURCE_PC = (0.00, 0.00, 1.00, 0.15)  # Polygon face colour (transparant)
+SOURCE_FC = (0.85, 0.85, 1.00)  # Marker face colour (a=0.15)
+SOURCE_LC = (0.65, 0.65, 1.00)  # Line colour (a=0.35)
+# ----------
+TARGET_EC = (1.00, 0.45, 0.00)  # Marker/polygon edge colour
+TARGET_PC = (1.00, 0.45, 0.00, 0.15)  # Polygon face colour (transparant)
+TARGET_FC = (1.00, 0.92, 0.85)  # Marker face colour (a=0.15)
+TARGET_LC = (1.00, 0.75, 0.55)  # Line colour (a=0.45)
+
+# Page layout (A4 portrait, two panels per page):
+PAGE_WIDTH, PAGE_HEIGHT = A4
+PANEL_WIDTH = PAGE_WIDTH - 2*cm
+PANEL_HEIGHT = PAGE_HEIGHT/2 - 1.5*cm
+
+# Locality map geometry:
+MAP_SIZE = 5*cm  # Printed map size (globe diameter)
+MAP_RESOLUTION = 0.1*mm  # Smallest printed detail (simplification tolerance)
+MAP_DENSIFY = 1.0  # Great circle box edge step (degrees)
+COASTLINE_LONLAT = None  # Natural Earth 110m coastlines (lon, lat, line id)
+GRATICULE_LONLAT = None  # Gridlines (lon, lat, line id)
+
+# PDF output:
+PDF_COMPRESSION = 1  # Compress page and form streams (0=No, 1=Yes)
+form_sizes = {}  # Shared form name -> compressed stream size (bytes)
+form_stats = {'uses': 0, 'hits': 0, 'bytes_saved': 0}
+
+# Draft chart (raster plot area, see make_chart_image):
+CHART_IMAGE_SIZE = (11.5*cm, 5.5*cm)
+
+# Quality presets (--quality):
+#   - map_resolution: map simplification (see make_map), None = no map.
+#   - chart_dpi: raster chart resolution (see make_chart_image), None =
+#     vector chart (matplotlib).
+#   - compression: PDF stream compression (0=No, 1=Yes).
+QUALITY_PRESETS = {
+    'draft':    {'map_resolution': None, 'chart_dpi': 100, 'compression': 0},
+    'standard': {'map_resolution': MAP_RESOLUTION, 'chart_dpi': None, 'compression': PDF_COMPRESSION},
+    'print':    {'map_resolution': 0.0, 'chart_dpi': None, 'compression': PDF_COMPRESSION}}
 
 
 #==============================================================================
@@ -68,551 +125,1752 @@ def main(argv):
     proxy_list = '_LiPD_List.txt'
     pdf_file = '.\\output\\dashboard_pdfs\\LiPD_Dashboards_20201214.pdf'
     # ----------
-    map_legend_flag = False
-    #bbox_dx = 20.0  # Bounding box side in degrees
-    #fig_dpi = 300  # Figure DPI setting for PNG
-
-    # Define colours:
-    source_ec = (0.00, 0.00, 1.00)  # Marker/polygon edge colour
-    source_pc = (0.00, 0.00, 1.00, 0.15)  # Polygon face colour (transparant)
-    source_fc = (0.85, 0.85, 1.00)  # Marker face colour (a=0.15)
-    source_lc = (0.65, 0.65, 1.00)  # Line colour (a=0.35)
+    cache_dir = '.\\output\\metadata_cache'  # Parsed metadata cache
     # ----------
-    target_ec = (1.00, 0.45, 0.00)  # Marker/polygon edge colour
-    target_pc = (1.00, 0.45, 0.00, 0.15)  # Polygon face colour (transparant)
-    target_fc = (1.00, 0.92, 0.85)  # Marker face colour (a=0.15)
-    target_lc = (1.00, 0.75, 0.55)  # Line colour (a=0.45)
-    
-    # Get list of files from proxy_list:
-    proxy_files = []
-    f = open(proxy_path + '\\' + proxy_list, 'r')
-    for i in f:
-        if i.strip()[0] != '#':
-            proxy_files.append(i.strip())
-        # end if
-    # end for
-    f.close()
+
+    # Command-line options (defaults as above):
+    parser = argparse.ArgumentParser(description='Create dashboard PDF from LiPD files.')
+    parser.add_argument('--proxy-path', default=proxy_path,
+                        help='Folder containing the LiPD files and proxy list')
+    parser.add_argument('--proxy-list', default=proxy_list,
+                        help='Text file listing the LiPD files (one per line)')
+    parser.add_argument('--source', default=None,
+                        help='LiPD data source: proxy list file, folder of .lpd files or '
+                             'zip/tar bundle of .lpd files (default: proxy_path/proxy_list)')
+    parser.add_argument('--pdf-file', default=pdf_file,
+                        help='Combined dashboard book (PDF)')
+    parser.add_argument('--quality', choices=['draft', 'standard', 'print'], default='standard',
+                        help='Map detail, chart fidelity and compression: draft (no map, '
+                             'raster chart), standard (simplified map) or print (full map)')
+    parser.add_argument('--pdf-dir', default=None,
+                        help='Also write one standalone PDF per dataset to this folder')
+    parser.add_argument('--png-dir', default=None,
+                        help='Also write one PNG thumbnail per dataset to this folder')
+    parser.add_argument('--json-dir', default=None,
+                        help='Also write a JSON sidecar of extracted fields per dataset to this folder')
+    parser.add_argument('--cache-dir', default=cache_dir,
+                        help='Folder for the parsed metadata cache')
+    parser.add_argument('--cache-size', type=float, default=64.0,
+                        help='Metadata cache size limit (MB)')
+    parser.add_argument('--cache-hash', action='store_true',
+                        help='Also key the metadata cache on file contents (MD5)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Don\'t use the disk metadata cache')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--list', action='store_true',
+                      help='List the LiPD files only (no rendering)')
+    mode.add_argument('--validate', action='store_true',
+                      help='Check each LiPD file can be rendered (no rendering)')
+    mode.add_argument('--dump', action='store_true',
+                      help='Print extracted fields as JSON (no rendering)')
+    mode.add_argument('--watch', action='store_true',
+                      help='Keep running and re-render the book when the LiPD files in '
+                           'the data source (proxy list or folder) change')
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help='Polling interval (s) for --watch')
+    args = parser.parse_args(argv[1:])
+    proxy_path = args.proxy_path
+    proxy_list = args.proxy_list
+    pdf_file = args.pdf_file
+    quality = QUALITY_PRESETS[args.quality]
+    if not args.no_cache:
+        xlipd.Set_Cache(args.cache_dir, int(args.cache_size * 1024**2), args.cache_hash)
+    # end if
+
+    # Data source:
+    if args.source is None:
+        source = os.path.join(proxy_path, proxy_list)
+    else:
+        source = args.source
+    # end if
+
+    # Lightweight modes (never import the graphics modules):
+    if args.list:
+        list_datasets(xlipd.List_LiPD_Source(source))
+        return
+    elif args.validate:
+        num_bad = validate_datasets(source)
+        print_cache_stats()
+        if num_bad > 0: sys.exit(1)
+        return
+    elif args.dump:
+        num_bad = dump_datasets(source)
+        if num_bad > 0: sys.exit(1)
+        return
+    # end if
 
     # Print program details
     print ('\nCreate dashboard PDF from LiPD files:')
-    print ('  proxy_path =', proxy_path)
-    print ('  proxy_list =', proxy_list)
+    if args.source is None:
+        print ('  proxy_path =', proxy_path)
+        print ('  proxy_list =', proxy_list)
+    else:
+        print ('  source =', source)
+    # end if
     print ('  pdf_file =', pdf_file)
+    print ('  quality =', args.quality)
+
+    # Set up extra output sinks:
+    sinks = []
+    if args.pdf_dir is not None: sinks.append(DatasetPDFSink(args.pdf_dir, quality['compression']))
+    if args.png_dir is not None: sinks.append(ThumbnailSink(args.png_dir))
+    if args.json_dir is not None: sinks.append(JSONSink(args.json_dir))
+
+    # Daemon mode (book is rebuilt from cached panels; source is re-read
+    # every poll, so it may be missing at start-up):
+    if args.watch:
+        if xlipd.LiPD_Source_Type(source) in ['zip', 'tar']:
+            print('\n--watch needs a proxy list or folder, not a bundle:', source)
+            sys.exit(1)
+        # end if
+        watch_datasets(source, pdf_file, sinks, args.interval, quality)
+        return
+    # end if
+
+    # List of files from the data source (debug only; the book doesn't need
+    # it, so the source is read once below):
     if DEBUG > 0:
         print ('  proxy_files:')
-        for i in proxy_files:
+        for i in xlipd.List_LiPD_Source(source):
             print('    "' + i + '"')
         # end for
     # end if
 
-    # Open up a new PDF canvas:
+    # Combined book plus extra sinks:
+    sinks.insert(0, BookSink(pdf_file, quality['compression']))
+
+    # Render each LiPD file once and pass the panel to every sink:
     print('\nCreating pdf file')
-    c = canvas.Canvas(pdf_file, pagesize=portrait(A4))
-    c_width, c_height = portrait(A4)
-
-    # Loop through LiPD files:
-    num_pages = (len(proxy_files) - 1)// 2 + 1
-    page = 0  # Page counter
-    item_top = True  # True if is item top of page (two items per page)
-    i_xloc = 1*cm
-    i_width = c_width - 2*cm
-    i_height = c_height/2 - 1.5*cm
-    print('\nLooping through LiPD files:')
-    for PF in proxy_files:
-        print('  "' + PF + '"')
+    try:
+        for sink in sinks:
+            sink.begin()
+        # end for
+        print('\nLooping through LiPD files:')
+        for PF, lipd in xlipd.Iter_LiPD_Source(source):
+            print('  "' + PF + '"')
+            try:
+                panel = build_panel(lipd, PF, quality)
+            except ValueError as e:
+                print(e)
+                sys.exit()
+            # end try
+            for sink in sinks:
+                sink.add(panel)
+            # end for
+            print_map_stats(panel)
+            panel.close()
+        # end for
+        for sink in sinks:
+            sink.end()
+        # end for
+    finally:
+        # Remove partial book on error/exit (nothing to remove once saved):
+        sinks[0].abort()
+    # end try
+    print_cache_stats()
+    print_form_stats()
 
-        # Deal with top or bottom page items:
-        if item_top:
-            page += 1
-            if page > 1: c.showPage()
-            i_yloc = c_height/2 + 0.5*cm
-            # Write date:
-            c.setFont('Helvetica-Oblique', 9)
-            c.drawRightString(c_width - 1.0*cm, c_height - 0.6*cm,
-                              'Created: ' + dt.datetime.now().strftime('%d-%b-%G')) 
-            # Write page number:
-            c.setFont('Helvetica', 9)
-            c.drawCentredString(c_width / 2.0,  0.4*cm,
-                                'Page ' + str(page) + ' of ' + str(num_pages))
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# List LiPD files and book pages (lightweight mode)
+#------------------------------------------------------------------------------
+def list_datasets(proxy_files):
+
+    for i, PF in enumerate(proxy_files):
+        print('%5d  page %4d  %s' % (i + 1, i // 2 + 1, PF))
+    # end for
+    print('\n' + str(len(proxy_files)) + ' LiPD files, ' +
+          str((len(proxy_files) - 1)// 2 + 1) + ' pages')
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Check LiPD files can be rendered (lightweight mode)
+#   - Reads metadata only; returns the number of files with problems.
+#------------------------------------------------------------------------------
+def validate_datasets(source):
+
+    num_ok = 0
+    num_bad = 0
+    for PF, lipd in xlipd.Iter_LiPD_Source(source):
+        problems = []
+        try:
+            LMeta, x_col_1, x_col_2 = xlipd.Read_JSON_Columns(lipd)
+            LTab = LMeta['paleoData'][0]['measurementTable'][0]
+            if x_col_1 == None: problems.append('can\'t find year or age column')
+            if x_col_2 == None: problems.append('can\'t find dataset column')
+            if not 'bag/data/' + LTab['filename'] in xlipd.List_Bag(lipd):
+                problems.append('missing data file ' + LTab['filename'])
+            # end if
+            if len(problems) == 0:
+                fields = extract_fields(LMeta, x_col_1, x_col_2)
+                if not (is_number(fields['longitude']) and is_number(fields['latitude'])):
+                    problems.append('bad coordinates')
+                # end if
+            # end if
+        except Exception as e:
+            problems.append(type(e).__name__ + ': ' + str(e))
+        # end try
+        if len(problems) == 0:
+            print('  OK    "' + PF + '"')
+            num_ok += 1
         else:
-            i_yloc = 1*cm
+            print('  FAIL  "' + PF + '": ' + '; '.join(problems))
+            num_bad += 1
         # end if
-        item_top = not item_top
-        
-        # Draw bounding rectangle:
-        c.rect(i_xloc, i_yloc, i_width, i_height, stroke=1, fill=0)
-
-        # Open LiPD metadata:
-        LMeta = xlipd.Read_JSON(proxy_path + '\\' + PF)
-        #print(LMeta.keys())
-
-        # Get subsets:
-        LPub = LMeta['pub']
-        #print(LPub.keys())
-
-        # Get measurment table #1:
-        LTab = LMeta['paleoData'][0]['measurementTable'][0]
-        LTab_columns = len(LTab['columns'])
-        if DEBUG > 0:
-            print('LTab_columns =', LTab_columns)
-
-        # Find first "year" or "age" column:
-        x_col_1 = None
-        # ---Try to find "YEAR CE/BCE"---
-        for i in range(LTab_columns):
-            stmp = xlipd.extract_string1(LTab['columns'][i], 'variableName', False, 'NA')
-            if stmp.split(' ')[0].upper() == 'YEAR':
-                x_col_1 = i
-                break
-            # end if
-        # end for
-        # ---Else try to find "AGE"---
-        if x_col_1 == None:
-            for i in range(LTab_columns):
-                stmp = xlipd.extract_string1(LTab['columns'][i], 'variableName', False, 'NA')
-                if stmp.split(' ')[0].upper() == 'AGE':
-                    x_col_1 = i
-                    break
+    # end for
+    print('\n' + str(num_ok) + ' OK, ' + str(num_bad) + ' failed')
+    return num_bad
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Print extracted fields for each LiPD file as JSON (lightweight mode)
+#   - Files that can't be read get an "error" field instead of the fields
+#     (as the validate_datasets message); returns the number of these.
+#------------------------------------------------------------------------------
+def dump_datasets(source):
+
+    dump = []
+    num_bad = 0
+    for PF, lipd in xlipd.Iter_LiPD_Source(source):
+        fields = {'file': PF}
+        try:
+            LMeta, x_col_1, x_col_2 = xlipd.Read_JSON_Columns(lipd)
+            fields.update(extract_fields(LMeta, x_col_1, x_col_2))
+        except Exception as e:
+            fields['error'] = type(e).__name__ + ': ' + str(e)
+            num_bad += 1
+        # end try
+        dump.append(fields)
+    # end for
+    print(json.dumps(dump, indent=2))
+    return num_bad
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Watch data source and keep the book up to date (daemon mode)
+#   - Polls the data source (proxy list or folder) and its LiPD files
+#     every "interval" seconds.  Paths are resolved as Iter_LiPD_Source
+#     (list entries relative to the list's folder).
+#   - Files are compared by size/mtime, then by MD5 hash, so touched but
+#     unchanged files are not re-rendered.
+#   - Only added or changed panels are re-rendered (with warm graphics
+#     state); the book is then rewritten atomically from cached panels.
+#   - Extra (per-dataset) sinks are only fed the re-rendered panels.
+#------------------------------------------------------------------------------
+def watch_datasets(source, pdf_file, extra_sinks=[], interval=5.0,
+                   quality=QUALITY_PRESETS['standard']):
+
+    print('\nWarming up renderer')
+    t0 = time.perf_counter()
+    warm_up()
+    for sink in extra_sinks:
+        sink.begin()
+    # end for
+    log('Renderer ready in %.2f s' % (time.perf_counter() - t0))
+
+    panels = {}  # Rendered panels (LiPD file -> DashboardPanel)
+    stamps = {}  # File identity (LiPD file -> (size, mtime, MD5))
+    book_files = None  # LiPD files in the last book written
+    book_failed = False  # True if the last book rewrite failed
+    print('\nWatching "' + source + '" every ' + str(interval) + ' s (Ctrl-C to stop)')
+    try:
+        while True:
+            t0 = time.perf_counter()
+
+            # Get list of files (and their paths) from the data source:
+            try:
+                lipd_files = dict(xlipd.Iter_LiPD_Source(source))
+                proxy_files = list(lipd_files)
+            except OSError as e:
+                log('Can\'t read data source: ' + str(e))
+                time.sleep(interval)
+                continue
+            # end try
+
+            # Find added, changed and removed LiPD files:
+            added, changed, removed = [], [], []
+            current = set()
+            for PF in proxy_files:
+                old = stamps.get(PF)
+                new = file_stamp(lipd_files[PF], old)
+                if new is None: continue  # Missing (treated as removed)
+                current.add(PF)
+                if old is None:
+                    added.append(PF)
+                elif new[2] != old[2]:
+                    changed.append(PF)
+                # end if
+                stamps[PF] = new
+            # end for
+            for PF in list(stamps):
+                if not PF in current:
+                    removed.append(PF)
+                    del stamps[PF]
+                    if PF in panels: del panels[PF]
                 # end if
             # end for
-        # end if
-        # ---Otherwise report error---
-        if x_col_1 == None:
-            print('Can\'t find year or age column')
-            sys.exit()
-        # end if
 
-        # Find dataset column (first with "variableType" = PROXY or RECONSTRUCTION):
-        x_col_2 = None
-        # ---First "variableType" with PROXY or RECONSTRUCTION---
-        # for i in range(LTab_columns):
-        #     stmp = xlipd.extract_string1(LTab['columns'][i], 'variableType', False, 'NA')
-        #     if stmp.upper() in ['PROXY', 'RECONSTRUCTION']: 
-        #         x_col_2 = i
-        #         break
-        #     # end if
-        # # end for
-        # ---Use specific column---
-        # x_col_2 = LTab_columns - 1  # Use last column
-        x_col_2 = LTab_columns - 2  # Use 2nd last column (last is QC)
-        # ---Otherwise report error---
-        if x_col_2 == None:
-            print('Can\'t find dataset column')
-            sys.exit()
-        # end if
+            # Re-render added and changed panels:
+            t1 = time.perf_counter()
+            failed = 0
+            for PF in added + changed:
+                try:
+                    panel = build_panel(lipd_files[PF], PF, quality)
+                    for sink in extra_sinks:
+                        sink.add(panel)
+                    # end for
+                    panel.chart_drawing, panel.map_drawing  # Convert before closing figures
+                    panel.close()
+                    panels[PF] = panel
+                except Exception as e:
+                    # Keep previous panel (if any) until the file is fixed
+                    log('Can\'t render "' + PF + '": ' + type(e).__name__ + ': ' + str(e))
+                    failed += 1
+                # end try
+            # end for
+            t2 = time.perf_counter()
+
+            # Rewrite book if any panel or the panel order changed (or the
+            # last rewrite failed, e.g. book open in a viewer on Windows):
+            ready = [PF for PF in proxy_files if PF in panels]
+            if ready != book_files or len(added + changed) > failed or book_failed:
+                book = BookSink(pdf_file, quality['compression'])
+                try:
+                    book.begin()
+                    for PF in ready:
+                        book.add(panels[PF])
+                    # end for
+                    book.end()
+                except Exception as e:
+                    # Keep old book; try again at the next poll
+                    book.abort()
+                    book_failed = True
+                    log('Can\'t write book: ' + type(e).__name__ + ': ' + str(e))
+                    time.sleep(interval)
+                    continue
+                # end try
+                book_files = ready
+                book_failed = False
+                t3 = time.perf_counter()
+                log('Updated: %d added, %d changed, %d removed, %d failed; '
+                    'render %.2f s, book %.2f s (%d panels), total %.2f s'
+                    % (len(added), len(changed), len(removed), failed,
+                       t2 - t1, t3 - t2, len(ready), t3 - t0))
+            elif failed > 0:
+                log('Not updated: %d added, %d changed, %d failed'
+                    % (len(added), len(changed), failed))
+            # end if
 
-        # Get table dataframe:
-        x_file = LTab['filename']
-        x_df = xlipd.Read_CSV2DF(proxy_path + '\\' + PF, x_file)
-        x_df = x_df.sort_values(by=x_df.columns[x_col_1], ascending=True)
-        if DEBUG > 0:
-            print('x_file =', x_file)
-            print('x_col_1 =', x_col_1)
-            print('x_col_2 =', x_col_2)
-            print('x_df:')
-            print(x_df)
-        # end if
-        
-        # Check if proxy or reconstruction:
-        # x_type = xlipd.extract_string1(LTab['columns'][x_col_2], 'variableType', 'NA')  # OLD
-        x_type = xlipd.extract_string1(LTab['columns'][x_col_2]['datasetType'], 'type', 'NA')
-        x_type = x_type.strip().upper()
-        # print('x_type = ', x_type)
- 
-        # If reconstruction check for "interpretation":
-        stmp = xlipd.extract_string1(LTab['columns'][x_col_2]['interpretationFormat'], 
-                                     'format', False, 'NA')
-        x_interp = not (stmp.strip().upper() in ['NONE', 'NULL', 'NA'])
-        #print('x_interp = ', x_interp)
- 
-    
-        # ---Data Information--------------------------------------------------
-
-        # Write dataset_name:
-        stmp = 'Dataset Name: ' + LMeta['dataSetName']
-        stmp = trim_string(stmp, 'Helvetica-Bold', 12, c_width - 3.0*cm)
-        c.setFont('Helvetica-Bold', 12)
-        c.drawString(i_xloc + 0.5*cm, i_yloc + i_height - 0.7*cm, stmp)
-
-        # Write dataset_id and reference_id:
-        c.setFont('Helvetica', 10)
-        stmp1 = xlipd.extract_string1(LMeta, 'dataSetID', False, 'NA')
-        stmp2 = xlipd.extract_string1(LMeta, 'referenceID', False, 'NA')
-        c.drawString(i_xloc + 0.5*cm, i_yloc + i_height - 1.2*cm,
-                     'Dataset ID: ' + stmp1 + '; Reference ID: ' + stmp2 )
-
-        # Set up paragraph and table styles:
-        pstyle = ParagraphStyle(name='Normal', fontName='Helvetica', fontSize=8,
-                                leftIndent=20, firstLineIndent=-20, leading=12)
-        twidth = (c_width - 3.5*cm) / 2.0
-        theight = 5.0*cm
-        tstyle = TableStyle([('VALIGN', (0,0), (0,0), 'TOP'),
-                             #('BOX', (0,0), (0,0), 0.5, colors.red),
-                             ('LEFTPADDING', (0,0), (0,0), 0),
-                             ('RIGHTPADDING', (0,0), (0,0), 0),
-                             ('TOPPADDING', (0,0), (0,0), 0),
-                             ('BOTTOMPADDING', (0,0), (0,0), 0)])
-
-        # Write metadata in column 1:
-        tpara = []
-        # ---LPub----------------------
-        # ---Author--------------------
-        # stmp = xlipd.extract_string1(LPub, 'author', False, 'NA')
-        # stmp1 = xlipd.extract_string1(LPub, 'year', False, 'NA')
-        # if is_number(stmp1): stmp1 = str(int(float(stmp1)))
-        # tpara.append(Paragraph('Author: ' + stmp + ' <i>et al</i>. (' + stmp1 +')', pstyle))
-        # ---Citation------------------
-        stmp = xlipd.extract_string1(LPub, 'citation', False, 'NA')
-        i = stmp.find('http')
-        if i > 0: stmp = stmp[:i-1]
-        if stmp[-1] == ',': stmp = stmp[:-1] + '.'
-        tpara.append(Paragraph('Citation: ' + stmp, pstyle))
-        # ---Citation DOI--------------
-        # Also try to remove dataURL from citation if it exists.
-        stmp = xlipd.extract_string1(LPub, 'doi', False, 'NA')
-        stmp1 = None
-        i = stmp.upper().find('DOI.ORG')
-        if i >= 0:
-            stmp = stmp[i+8:]
-            stmp1 = 'https://doi.org/' + stmp
-        # end if
-        i = stmp.upper().find('DOI:')
-        if i >= 0:
-            stmp = stmp[i+4:].strip()
-            stmp1 = 'https://doi.org/' + stmp
-        # end if
-        i = stmp.upper().find('HTTP')
-        if i >= 0:
-            stmp1 = stmp
-        # end if
-        stmp = trim_string('Citation DOI: ' + stmp, 'Helvetica', 8, twidth)
-        stmp = stmp[14:]
-        if not stmp1 is None:
-            stmp = '<link href="' + stmp1 + '" color="blue"><u>' + stmp + '</u></link>'
+            time.sleep(interval)
+        # end while
+    except KeyboardInterrupt:
+        print('\nStopped watching')
+    # end try
+
+    for sink in extra_sinks:
+        sink.end()
+    # end for
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# File identity for change detection
+#   - Returns (size, mtime, MD5 hex digest), or None if file is missing.
+#   - The hash is only recomputed when size or mtime differ from old.
+#------------------------------------------------------------------------------
+def file_stamp(file, old=None):
+
+    try:
+        st = os.stat(file)
+    except OSError:
+        return None
+    # end try
+    if old is not None and old[:2] == (st.st_size, st.st_mtime_ns):
+        return old
+    # end if
+    md5 = hashlib.md5()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            md5.update(chunk)
+        # end for
+    # end with
+    return (st.st_size, st.st_mtime_ns, md5.hexdigest())
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Load and initialise the graphics modules once (daemon mode)
+#   - Imports matplotlib/cartopy/ReportLab/svglib, reads the Natural Earth
+#     coastlines (cached by cartopy) and loads font metrics.
+#------------------------------------------------------------------------------
+def warm_up():
+
+    import matplotlib.pyplot as plt
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    from svglib.svglib import svg2rlg
+
+    # Natural Earth coastlines and gridlines:
+    coastline_lonlat()
+    graticule_lonlat()
+
+    # Fonts (ReportLab metrics and matplotlib font cache):
+    for font in ['Helvetica', 'Helvetica-Bold', 'Helvetica-Oblique']:
+        stringWidth('Created', font, 9)
+    # end for
+    fig = plt.figure(figsize=(1, 1))
+    plt.xlabel('Year', fontsize=14, fontweight='bold')
+    figure_to_drawing(fig, 'height', 1*cm)
+    plt.close(fig)
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Print map vertex counts and SVG size
+#------------------------------------------------------------------------------
+def print_map_stats(panel):
+    stats = panel.map_stats
+    if not 'vertices' in stats:
+        print('    map: not drawn')
+        return
+    # end if
+    stmp = '    map: %d vertices (%d coast, %d grid, %d boxes)' % (
+           stats['vertices'], stats['coast'], stats['grid'], stats['boxes'])
+    if 'svg_bytes' in stats: stmp += ', SVG %.1f kB' % (stats['svg_bytes'] / 1024.0)
+    print(stmp)
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Print metadata cache statistics
+#------------------------------------------------------------------------------
+def print_cache_stats():
+    stats = xlipd.Cache_Stats()
+    print('\nMetadata cache: %d memory hits, %d disk hits, %d misses (%.0f%% hit rate), %d evicted'
+          % (stats['memory_hits'], stats['disk_hits'], stats['misses'],
+             100.0 * stats['hit_rate'], stats['evictions']))
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Print shared PDF form statistics
+#   - bytes saved is an estimate: the (compressed) size of the content of
+#     every reused form, not measured in the PDF file.
+#------------------------------------------------------------------------------
+def print_form_stats():
+    uses = form_stats['uses']
+    hit_rate = form_stats['hits'] / float(uses) if uses > 0 else 0.0
+    print('Shared PDF forms: %d of %d uses reused (%.0f%% hit rate), ~%.1f kB saved (estimate)'
+          % (form_stats['hits'], uses, 100.0 * hit_rate, form_stats['bytes_saved'] / 1024.0))
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Print message with time stamp
+#------------------------------------------------------------------------------
+def log(message):
+    print(dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + '  ' + message)
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Rendered dataset panel
+#   - Intermediate shared by all output sinks.
+#   - fields: extracted metadata (plain strings, JSON serialisable).
+#   - para1, para2: metadata paragraphs for the two text columns.
+#   - chart_fig, map_fig: matplotlib figures (open until close()).
+#   - chart_drawing, map_drawing: ReportLab drawings, converted from SVG on
+#     first use and then reused by every PDF sink.  map_drawing is a
+#     (base, overlay) pair, see figure_to_svg_layers, or empty if there is
+#     no map (map_fig None).
+#   - chart_image: raster chart (PIL image), used instead of chart_fig.
+#   - chart_key, map_keys: SVG content hashes of the drawings (shared form
+#     names, see draw_shared).
+#   - map_base: map artists drawn in the base layer (coastlines, gridlines).
+#   - map_stats: map vertex counts (see make_map) and SVG size ("svg_bytes").
+#------------------------------------------------------------------------------
+class DashboardPanel:
+
+    def __init__(self, name, fields, para1, para2, chart_fig, map_fig, map_stats=None,
+                 map_base=[], chart_image=None):
+        self.name = name
+        self.fields = fields
+        self.para1 = para1
+        self.para2 = para2
+        self.chart_fig = chart_fig
+        self.map_fig = map_fig
+        self.map_stats = map_stats if map_stats is not None else {}
+        self.map_base = map_base
+        self.chart_image = chart_image
+        self._chart_drawing = None
+        self._map_drawing = None
+        self.chart_key = None
+        self.map_keys = None
+    # end def
+
+    @property
+    def chart_drawing(self):
+        if self._chart_drawing is None and self.chart_image is not None:
+            # Key on the image and the x label drawn under it:
+            self.chart_key = hashlib.md5(self.chart_image.tobytes() +
+                                         self.fields['x_label'].encode('utf-8')).hexdigest()
+            self._chart_drawing = image_to_drawing(self.chart_image, self.fields['x_label'])
+        elif self._chart_drawing is None:
+            svg = figure_to_svg(self.chart_fig)
+            self.chart_key = hashlib.md5(svg).hexdigest()
+            self._chart_drawing = svg_to_drawing(svg, 'height', 6*cm)
         # end if
-        tpara.append(Paragraph('Citation DOI: ' + stmp, pstyle))
-        # ---Data Citation-------------
-        # Also try to remove dataURL from citation if it exists.
-        stmp = xlipd.extract_string1(LPub, 'dataCitation', False, 'NA')
-        i = stmp.find('http')
-        if i > 0:
-            j = stmp[i:].find(' ')
-            if j > 0:
-                stmp = stmp[:i-1] + stmp[i+j:]
+        return self._chart_drawing
+    # end def
+
+    @property
+    def map_drawing(self):
+        if self._map_drawing is None:
+            if self.map_fig is None:
+                svgs = []
             else:
-                stmp = stmp[:i-1]
+                svgs = figure_to_svg_layers(self.map_fig, self.map_base)
+                self.map_stats['svg_bytes'] = sum([len(i) for i in svgs])
             # end if
+            self.map_keys = tuple([hashlib.md5(i).hexdigest() for i in svgs])
+            self._map_drawing = tuple([svg_to_drawing(i, 'height', MAP_SIZE) for i in svgs])
         # end if
-        stmp = stmp.strip()
-        if stmp[-1] == ',': stmp = stmp[:-1] + '.'
-        if stmp[-1] != '.': stmp = stmp + '.'
-        tpara.append(Paragraph('Data Citation: ' + stmp, pstyle))
-        # ---Data URL------------------
-        stmp = xlipd.extract_string1(LPub, 'dataUrl', False, 'NA')
-        stmp1 = None
-        i = stmp.upper().find('DOI:')
-        if i >= 0:
-            stmp = 'https://doi.org/' + stmp[i+4:].strip()
+        return self._map_drawing
+    # end def
+
+    def close(self):
+        # Close figures (drawings already made are kept):
+        for fig in [self.chart_fig, self.map_fig]:
+            if fig is None: continue
+            import matplotlib.pyplot as plt
+            plt.close(fig)
+        # end for
+        self.chart_fig = None
+        self.map_fig = None
+        self.map_base = []
+    # end def
+
+# end class
+
+
+
+
+#------------------------------------------------------------------------------
+# Render one LiPD file into a DashboardPanel
+#   - lipd_file is a file name or a seekable stream (e.g. bundle member from
+#     xlipd.Iter_LiPD_Source, name required).
+#   - quality is one of QUALITY_PRESETS (default standard).
+#------------------------------------------------------------------------------
+def build_panel(lipd_file, name=None, quality=QUALITY_PRESETS['standard']):
+
+    if name is None: name = os.path.basename(lipd_file)
+
+    # Open LiPD metadata (and year/age and dataset columns, see below):
+    LMeta, x_col_1, x_col_2 = xlipd.Read_JSON_Columns(lipd_file)
+    #print(LMeta.keys())
+
+    # Get measurment table #1:
+    LTab = LMeta['paleoData'][0]['measurementTable'][0]
+    if DEBUG > 0:
+        print('LTab_columns =', len(LTab['columns']))
+
+    # Check year/age and dataset columns:
+    if x_col_1 == None:
+        raise ValueError('Can\'t find year or age column')
+    # end if
+    if x_col_2 == None:
+        raise ValueError('Can\'t find dataset column')
+    # end if
+
+    # Get table dataframe:
+    x_file = LTab['filename']
+    x_df = xlipd.Read_CSV2DF(lipd_file, x_file)
+    x_df = x_df.sort_values(by=x_df.columns[x_col_1], ascending=True)
+    if DEBUG > 0:
+        print('x_file =', x_file)
+        print('x_col_1 =', x_col_1)
+        print('x_col_2 =', x_col_2)
+        print('x_df:')
+        print(x_df)
+    # end if
+
+    # Extract fields and make paragraphs, chart and map:
+    fields = extract_fields(LMeta, x_col_1, x_col_2)
+    para1, para2 = make_paragraphs(fields)
+    if quality['chart_dpi'] is None:
+        chart_fig, chart_image = make_chart(x_df, x_col_1, x_col_2, fields), None
+    else:
+        chart_fig, chart_image = None, make_chart_image(x_df, x_col_1, x_col_2, fields,
+                                                        quality['chart_dpi'])
+    # end if
+    if quality['map_resolution'] is None:
+        map_fig, map_stats, map_base = None, {}, []
+    else:
+        map_fig, map_stats, map_base = make_map(LMeta, quality['map_resolution'])
+    # end if
+
+    return DashboardPanel(name, fields, para1, para2, chart_fig, map_fig, map_stats, map_base,
+                          chart_image)
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Extract display fields from LiPD metadata
+#   - Plain strings only (no markup or trimming), so the result can be
+#     written as a JSON sidecar as well as used for the paragraphs.
+#------------------------------------------------------------------------------
+def extract_fields(LMeta, x_col_1, x_col_2):
+
+    LPub = LMeta['pub']
+    LTab = LMeta['paleoData'][0]['measurementTable'][0]
+    LCol1 = LTab['columns'][x_col_1]
+    LCol2 = LTab['columns'][x_col_2]
+    fields = {}
+
+    # Check if proxy or reconstruction:
+    # x_type = xlipd.extract_string1(LCol2, 'variableType', 'NA')  # OLD
+    x_type = xlipd.extract_string1(LCol2['datasetType'], 'type', 'NA')
+    fields['type'] = x_type.strip().upper()
+
+    # If reconstruction check for "interpretation":
+    stmp = xlipd.extract_string1(LCol2['interpretationFormat'], 'format', False, 'NA')
+    fields['interpretation'] = not (stmp.strip().upper() in ['NONE', 'NULL', 'NA'])
+
+    # ---Dataset name and IDs------
+    fields['dataset_name'] = LMeta['dataSetName']
+    fields['dataset_id'] = xlipd.extract_string1(LMeta, 'dataSetID', False, 'NA')
+    fields['reference_id'] = xlipd.extract_string1(LMeta, 'referenceID', False, 'NA')
+
+    # ---LPub----------------------
+    # ---Citation------------------
+    stmp = xlipd.extract_string1(LPub, 'citation', False, 'NA')
+    i = stmp.find('http')
+    if i > 0: stmp = stmp[:i-1]
+    if stmp[-1] == ',': stmp = stmp[:-1] + '.'
+    fields['citation'] = stmp
+    # ---Citation DOI--------------
+    # Also try to remove dataURL from citation if it exists.
+    stmp = xlipd.extract_string1(LPub, 'doi', False, 'NA')
+    stmp1 = None
+    i = stmp.upper().find('DOI.ORG')
+    if i >= 0:
+        stmp = stmp[i+8:]
+        stmp1 = 'https://doi.org/' + stmp
+    # end if
+    i = stmp.upper().find('DOI:')
+    if i >= 0:
+        stmp = stmp[i+4:].strip()
+        stmp1 = 'https://doi.org/' + stmp
+    # end if
+    i = stmp.upper().find('HTTP')
+    if i >= 0:
+        stmp1 = stmp
+    # end if
+    fields['citation_doi'] = stmp
+    fields['citation_doi_link'] = stmp1
+    # ---Data Citation-------------
+    # Also try to remove dataURL from citation if it exists.
+    stmp = xlipd.extract_string1(LPub, 'dataCitation', False, 'NA')
+    i = stmp.find('http')
+    if i > 0:
+        j = stmp[i:].find(' ')
+        if j > 0:
+            stmp = stmp[:i-1] + stmp[i+j:]
+        else:
+            stmp = stmp[:i-1]
         # end if
-        i = stmp.upper().find('HTTP')
-        if i >= 0:
-            stmp1 = stmp
+    # end if
+    stmp = stmp.strip()
+    if stmp[-1] == ',': stmp = stmp[:-1] + '.'
+    if stmp[-1] != '.': stmp = stmp + '.'
+    fields['data_citation'] = stmp
+    # ---Data URL------------------
+    stmp = xlipd.extract_string1(LPub, 'dataUrl', False, 'NA')
+    stmp1 = None
+    i = stmp.upper().find('DOI:')
+    if i >= 0:
+        stmp = 'https://doi.org/' + stmp[i+4:].strip()
+    # end if
+    i = stmp.upper().find('HTTP')
+    if i >= 0:
+        stmp1 = stmp
+    # end if
+    fields['data_url'] = stmp
+    fields['data_url_link'] = stmp1
+
+    # ---Data----------------------
+    fields['site_name'] = xlipd.extract_string1(LMeta['geo'], 'siteName', False, 'NA')
+    fields['archive_type'] = xlipd.extract_string1(LMeta, 'archiveType', False, 'NA')
+    fields['variable_type'] = xlipd.extract_string1(LCol2, 'variableType', False, 'NA')
+    fields['variable_name'] = xlipd.extract_string1(LCol2, 'variableName', False, 'NA')
+    fields['variable_units'] = xlipd.extract_string1(LCol2, 'units', False, 'NA')
+    if fields['type'] == 'PROXY':
+        fields['climate_parameter'] = xlipd.extract_string1(LCol2, 'climateParameter', False, 'NA')
+    # end if
+    stmp = xlipd.extract_string1(LCol1, 'startYear', False, 'NA')
+    if is_number(stmp): stmp = str(int(float(stmp)))
+    fields['start_year'] = stmp
+    stmp = xlipd.extract_string1(LCol1, 'endYear', False, 'NA')
+    if is_number(stmp): stmp = str(int(float(stmp)))
+    fields['end_year'] = stmp
+
+    # ---Axis labels---------------
+    stmp = xlipd.extract_string1(LCol1, 'variableName', False, 'NA')
+    stmp1 = xlipd.extract_string1(LCol1, 'units', False, 'NA')
+    if stmp1.strip().upper() in ['UNITLESS', 'NA']: stmp1 = '-'
+    fields['x_label'] = stmp + ' (' + stmp1 + ')'
+    # ----------
+    stmp = xlipd.extract_string1(LCol2, 'variableName', False, 'NA')
+    if fields['interpretation']:
+        stmp1 = xlipd.extract_string1(LCol2['interpretationFormat'], 'format', False, 'NA')
+    else:
+        stmp1 = xlipd.extract_string1(LCol2, 'units', False, 'NA')
+    # end if
+    if stmp1.strip().upper() in ['UNITLESS', 'NA']: stmp1 = '-'
+    fields['y_label'] = stmp + ' (' + stmp1 + ')'
+
+    # ---Location------------------
+    fields['longitude'] = LMeta['geo']['geometry']['coordinates'][0]
+    fields['latitude'] = LMeta['geo']['geometry']['coordinates'][1]
+    fields['target_values'] = LMeta['geo']['detailedCoordinates']['target']['values']
+    fields['source_values'] = LMeta['geo']['detailedCoordinates']['source']['values']
+
+    return fields
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Make metadata paragraphs for the two text columns
+#------------------------------------------------------------------------------
+def make_paragraphs(fields):
+
+    from reportlab.platypus import Paragraph
+    from reportlab.lib.styles import ParagraphStyle
+
+    # Set up paragraph style:
+    pstyle = ParagraphStyle(name='Normal', fontName='Helvetica', fontSize=8,
+                            leftIndent=20, firstLineIndent=-20, leading=12)
+    twidth = (PAGE_WIDTH - 3.5*cm) / 2.0
+
+    # Write metadata in column 1:
+    para1 = []
+    # ---Author--------------------
+    # stmp = xlipd.extract_string1(LPub, 'author', False, 'NA')
+    # stmp1 = xlipd.extract_string1(LPub, 'year', False, 'NA')
+    # if is_number(stmp1): stmp1 = str(int(float(stmp1)))
+    # para1.append(Paragraph('Author: ' + stmp + ' <i>et al</i>. (' + stmp1 +')', pstyle))
+    # ---Citation------------------
+    para1.append(Paragraph('Citation: ' + fields['citation'], pstyle))
+    # ---Citation DOI--------------
+    stmp = trim_string('Citation DOI: ' + fields['citation_doi'], 'Helvetica', 8, twidth)
+    stmp = stmp[14:]
+    if not fields['citation_doi_link'] is None:
+        stmp = '<link href="' + fields['citation_doi_link'] + '" color="blue"><u>' + stmp + '</u></link>'
+    # end if
+    para1.append(Paragraph('Citation DOI: ' + stmp, pstyle))
+    # ---Data Citation-------------
+    para1.append(Paragraph('Data Citation: ' + fields['data_citation'], pstyle))
+    # ---Data URL------------------
+    stmp = trim_string('Data URL: ' + fields['data_url'], 'Helvetica', 8, twidth)
+    stmp = stmp[10:]
+    if not fields['data_url_link'] is None:
+        stmp = '<link href="' + fields['data_url_link'] + '" color="blue"><u>' + stmp + '</u></link>'
+    # end if
+    para1.append(Paragraph('Data URL: ' + stmp, pstyle))
+
+    # Write metadata in column 2:
+    para2 = []
+    para2.append(Paragraph('Site Name: ' + fields['site_name'], pstyle))
+    para2.append(Paragraph('Archive Type: ' + fields['archive_type'], pstyle))
+    para2.append(Paragraph('Variable Type: ' + fields['variable_type'], pstyle))
+    para2.append(Paragraph('Variable Name: ' + fields['variable_name'], pstyle))
+    para2.append(Paragraph('Variable Units: ' + fields['variable_units'], pstyle))
+    if fields['type'] == 'PROXY':
+        para2.append(Paragraph('Climate Parameter: ' + fields['climate_parameter'], pstyle))
+    # end if
+    para2.append(Paragraph('Start Year: ' + fields['start_year'] + ' CE', pstyle))
+    para2.append(Paragraph('End Year: ' + fields['end_year'] + ' CE', pstyle))
+
+    return para1, para2
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Make time series chart
+#   - Returns the matplotlib figure (caller closes it).
+#------------------------------------------------------------------------------
+def make_chart(x_df, x_col_1, x_col_2, fields):
+
+    import numpy as np
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import PathPatch
+
+    # Proxy (source) or reconstruction (target) colours:
+    if fields['type'] == 'PROXY':
+        fc, ec, lc = SOURCE_FC, SOURCE_EC, SOURCE_LC
+    else:
+        fc, ec, lc = TARGET_FC, TARGET_EC, TARGET_LC
+    # end if
+
+    # Replace data values of "-999" within tolerance with NaN:
+    x_df.loc[abs(x_df[x_col_2] + 999.0) < 0.001, x_col_2] = np.nan
+
+    # Make graph:
+    fig = plt.figure(figsize=(12, 6))
+    plt.xlabel(fields['x_label'], fontsize=14, fontweight='bold', wrap=True)
+    plt.ylabel(textwrap.fill(fields['y_label'], 40), fontsize=14, fontweight='bold', wrap=True)
+    if fields['interpretation']:
+        ymin = min(-3.0, min(x_df.iloc[:,x_col_2])) * 1.05
+        ymax = max( 3.0, max(x_df.iloc[:,x_col_2])) * 1.05
+        plt.ylim([ymin, ymax])
+        plt.axhline(0.0, color='grey', linewidth=0.5, zorder=1)
+        #plt.bar(x_df.iloc[:,x_col_1], x_df.iloc[:,x_col_2],
+        #        width=1.0, color=fc, linewidth=0.5,
+        #        edgecolor=ec, zorder=2)
+        # Bars as one compound path (one SVG/ReportLab object for any
+        # number of years, same look as plt.bar):
+        ax = plt.gca()
+        ax.add_patch(PathPatch(bar_path(x_df.iloc[:,x_col_1], x_df.iloc[:,x_col_2], 1.0),
+                               fc=fc, lw=0.5, ec=ec, zorder=2))
+        ax.autoscale_view()
+    else:
+        plt.plot(x_df.iloc[:,x_col_1], x_df.iloc[:,x_col_2],
+                 color=lc, linewidth=0.5,
+                 marker='o', markersize=5.0, markerfacecolor=fc,
+                 markeredgecolor=ec, markeredgewidth=1.0)
+    # end if
+
+    # Show graph:
+    #plt.show()
+
+    return fig
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Make draft time series graph (raster, no matplotlib)
+#   - Returns a PIL image of CHART_IMAGE_SIZE at dpi: plot area only (no
+#     ticks or labels), with the same colours and y limits as make_chart.
+#   - Bars are merged per pixel column when there are more years than
+#     pixels; lines are drawn without markers when points are closer than
+#     the marker size.
+#------------------------------------------------------------------------------
+def make_chart_image(x_df, x_col_1, x_col_2, fields, dpi=100):
+
+    import numpy as np
+    from PIL import Image, ImageDraw  # Installed with matplotlib
+
+    # Proxy (source) or reconstruction (target) colours:
+    if fields['type'] == 'PROXY':
+        fc, ec, lc = SOURCE_FC, SOURCE_EC, SOURCE_LC
+    else:
+        fc, ec, lc = TARGET_FC, TARGET_EC, TARGET_LC
+    # end if
+    fc, ec, lc = [tuple([int(round(255*i)) for i in j[:3]]) for j in [fc, ec, lc]]
+
+    # Data values (without "-999" within tolerance and NaN):
+    x = x_df.iloc[:,x_col_1].to_numpy(dtype=float)
+    y = x_df.iloc[:,x_col_2].to_numpy(dtype=float)
+    ok = np.isfinite(x) & np.isfinite(y) & (abs(y + 999.0) >= 0.001)
+    x, y = x[ok], y[ok]
+
+    # Image and axes limits (5% margins, as matplotlib):
+    width = int(round(CHART_IMAGE_SIZE[0] / inch * dpi))
+    height = int(round(CHART_IMAGE_SIZE[1] / inch * dpi))
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    if len(x) == 0:
+        draw.rectangle([0, 0, width-1, height-1], outline='black')
+        return image
+    # end if
+    if fields['interpretation']:
+        xmin, xmax = min(x) - 0.5, max(x) + 0.5
+        ymin = min(-3.0, min(y)) * 1.05
+        ymax = max( 3.0, max(y)) * 1.05
+    else:
+        xmin, xmax = min(x), max(x)
+        ymin, ymax = min(y), max(y)
+        if ymax == ymin: ymin, ymax = ymin - 0.5, ymax + 0.5
+        ymin, ymax = ymin - 0.05*(ymax - ymin), ymax + 0.05*(ymax - ymin)
+    # end if
+    if xmax == xmin: xmin, xmax = xmin - 0.5, xmax + 0.5
+    xmin, xmax = xmin - 0.05*(xmax - xmin), xmax + 0.05*(xmax - xmin)
+    px = lambda i: (np.asarray(i) - xmin) / (xmax - xmin) * (width - 1)
+    py = lambda i: (ymax - np.asarray(i)) / (ymax - ymin) * (height - 1)
+
+    # Draw bars or line:
+    if fields['interpretation']:
+        draw.line([0, py(0.0), width-1, py(0.0)], fill=(128, 128, 128))
+        if len(x) > width:
+            col = np.clip(px(x).round().astype(int), 0, width-1)
+            lo, hi = np.zeros(width), np.zeros(width)
+            np.minimum.at(lo, col, y)
+            np.maximum.at(hi, col, y)
+            for i in np.nonzero(lo != hi)[0]:
+                draw.line([i, py(hi[i]), i, py(lo[i])], fill=ec)
+            # end for
+        else:
+            for x0, x1, y0, y1 in zip(px(x - 0.5), px(x + 0.5),
+                                      py(np.minimum(y, 0.0)), py(np.maximum(y, 0.0))):
+                draw.rectangle([x0, y1, x1, y0], fill=fc, outline=ec)
+            # end for
         # end if
-        stmp = trim_string('Data URL: ' + stmp, 'Helvetica', 8, twidth)
-        stmp = stmp[10:]
-        if not stmp1 is None:
-            stmp = '<link href="' + stmp1 + '" color="blue"><u>' + stmp + '</u></link>'
+    else:
+        xy = np.stack([px(x), py(y)], axis=1)
+        draw.line(xy.ravel().tolist(), fill=lc)
+        if len(x) * 8 <= width:
+            for i, j in xy:
+                draw.ellipse([i-3, j-3, i+3, j+3], fill=fc, outline=ec)
+            # end for
         # end if
-        tpara.append(Paragraph('Data URL: ' + stmp, pstyle))
-        # ---Table---------------------
-        tdata = [[tpara]]
-        t = Table(tdata, colWidths=twidth, rowHeights=theight, style=tstyle)
-        t.wrapOn(c, twidth, theight)
-        t.drawOn(c, i_xloc + 0.5*cm, i_yloc + i_height - 1.7*cm - theight)
-
-        # Write metadata in column 2:
-        tpara = []
-        # ---Data-------
-        stmp = xlipd.extract_string1(LMeta['geo'], 'siteName', False, 'NA')
-        tpara.append(Paragraph('Site Name: ' + stmp, pstyle))
-        # ----------
-        stmp = xlipd.extract_string1(LMeta, 'archiveType', False, 'NA')
-        tpara.append(Paragraph('Archive Type: ' + stmp, pstyle))
-        # ----------
-        stmp = xlipd.extract_string1(LTab['columns'][x_col_2], 'variableType', False, 'NA')
-        #stmp = 'Proxy'
-        tpara.append(Paragraph('Variable Type: ' + stmp, pstyle))
-        # ----------
-        stmp = xlipd.extract_string1(LTab['columns'][x_col_2], 'variableName', False, 'NA')
-        tpara.append(Paragraph('Variable Name: ' + stmp, pstyle))
-        # ----------
-        stmp = xlipd.extract_string1(LTab['columns'][x_col_2], 'units', False, 'NA')
-        tpara.append(Paragraph('Variable Units: ' + stmp, pstyle))
-        # ----------
-        if x_type == 'PROXY':
-            stmp = xlipd.extract_string1(LTab['columns'][x_col_2], 'climateParameter', False, 'NA')
-            tpara.append(Paragraph('Climate Parameter: ' + stmp, pstyle))
+    # end if
+    draw.rectangle([0, 0, width-1, height-1], outline='black')
+
+    return image
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Bar chart as a single compound path
+#   - One closed rectangle per bar, centred on x, from 0 to y (bars with a
+#     missing x or y are left out, as plt.bar).
+#------------------------------------------------------------------------------
+def bar_path(x, y, width=1.0):
+
+    import numpy as np
+    from matplotlib.path import Path
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    ok = np.isfinite(x) & np.isfinite(y)
+    x0 = x[ok] - width/2.0
+    x1 = x[ok] + width/2.0
+    y1 = y[ok]
+    y0 = np.zeros_like(y1)
+
+    # Anticlockwise from bottom left (as Rectangle), closed:
+    verts = np.stack([np.stack([x0, x1, x1, x0, x0], axis=1),
+                      np.stack([y0, y0, y1, y1, y0], axis=1)], axis=2)
+    codes = np.tile([Path.MOVETO, Path.LINETO, Path.LINETO, Path.LINETO, Path.CLOSEPOLY],
+                    len(y1))
+    return Path(verts.reshape(-1, 2), codes)
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Make locality map
+#   - Returns the matplotlib figure (caller closes it), vertex counts
+#     {'coast', 'grid', 'boxes', 'vertices'} and the base layer artists
+#     (coastlines and gridlines, see figure_to_svg_layers).
+#   - Coastlines, gridlines and boxes are projected in batches (see
+#     project_lines/project_polygon), clipped to the visible hemisphere and
+#     simplified to "resolution" (printed size, 0 = no simplification) for
+#     a MAP_SIZE map.
+#------------------------------------------------------------------------------
+def make_map(LMeta, resolution=MAP_RESOLUTION):
+
+    import matplotlib
+    import matplotlib.pyplot as plt
+    from matplotlib.lines import Line2D
+    from matplotlib.collections import LineCollection
+    import cartopy.crs as ccrs
+
+    # Get coordinates:
+    plon = LMeta['geo']['geometry']['coordinates'][0]
+    plat = LMeta['geo']['geometry']['coordinates'][1]
+    proj = ccrs.Orthographic(central_longitude=plon, central_latitude=plat)
+    R = proj.globe.semimajor_axis  # Spherical globe radius (m)
+    tolerance = 2.0 * resolution / MAP_SIZE  # Unit sphere (diameter 2 = MAP_SIZE)
+    stats = {}
+
+    # Create map:
+    fig = plt.figure(figsize=(5, 5))
+    ax = plt.axes(projection=proj)
+
+    # Add coastlines and grid:
+    lines = project_lines(*coastline_lonlat(), plon, plat, tolerance)
+    coast = ax.add_collection(LineCollection([i*R for i in lines], colors='black',
+                                             linewidths=1.0, zorder=1), autolim=False)
+    stats['coast'] = sum([len(i) for i in lines])
+    lines = project_lines(*graticule_lonlat(), plon, plat, tolerance)
+    grid = ax.add_collection(LineCollection([i*R for i in lines],
+                                            colors=matplotlib.rcParams['grid.color'],
+                                            linewidths=matplotlib.rcParams['grid.linewidth'],
+                                            zorder=1), autolim=False)
+    stats['grid'] = sum([len(i) for i in lines])
+    ax.set_global()
+
+    # Add location point:
+    # plt.scatter(plon, plat, s=50, c=(0.0,0.0,1.0,0.35), marker='o',
+    #             edgecolors='blue', linewidths=1,
+    #             transform=proj)
+    #             #transform=ccrs.PlateCarree())
+
+    # Add bounding box or circle with user-defined radius:
+    # proj = ccrs.Orthographic(central_longitude=plon, central_latitude=plat)
+    # r_ortho = compute_radius(plon, plat, proj, BBOX_DX/2)
+    # ax.add_patch(mpatches.Circle(xy=[plon, plat],
+    #                                 radius=r_ortho,
+    #                                 facecolor=(0.0,0.0,1.0,0.15),
+    #                                 edgecolor='blue', linewidth=1,
+    #                                 transform=proj))
+
+    # Add target and source bounding boxes or points:
+    stats['boxes'] = add_bbox(ax, LMeta['geo']['detailedCoordinates']['target']['values'],
+                              'D', TARGET_PC, TARGET_EC, tolerance)
+    stats['boxes'] += add_bbox(ax, LMeta['geo']['detailedCoordinates']['source']['values'],
+                               's', SOURCE_PC, SOURCE_EC, tolerance)
+    stats['vertices'] = stats['coast'] + stats['grid'] + stats['boxes']
+
+    # Add custom legend:
+    if MAP_LEGEND_FLAG:
+        legend_elements = [Line2D([0], [0], marker='s', label='Source',
+                                  c=SOURCE_EC, lw=1.0,
+                                  mfc=SOURCE_FC, mec=SOURCE_EC, mew=1.0),
+                           Line2D([0], [0], marker='D', label='Target',
+                                  c=TARGET_EC, lw=1.0,
+                                  mfc=TARGET_FC, mec=TARGET_EC, mew=1.0)]
+        ax.legend(handles=legend_elements, loc='upper right')
+    # end if
+
+    # Show graph:
+    # plt.show()
+
+    return fig, stats, [coast, grid]
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Add bounding box or point to map
+#   - bbstr is "lon1,lon2,lat1,lat2,..." from detailedCoordinates.
+#   - Box edges are great circles (as ccrs.Geodetic), clipped to the visible
+#     hemisphere and simplified to tolerance (unit sphere).
+#   - Returns the number of vertices drawn.
+#------------------------------------------------------------------------------
+def add_bbox(ax, bbstr, marker, pc, ec, tolerance=0.0):
+
+    import numpy as np
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as mpatches
+    import cartopy.crs as ccrs
+
+    num_vertices = 0
+    if bbstr is None: bbstr = 'NA,NA,NA,NA,NA'
+    bbstrs = [x for x in bbstr.split(',')]
+    if is_number(bbstrs[0]):
+        bblon1 = float(bbstrs[0])
+        if is_number(bbstrs[1]):
+            bblon2 = float(bbstrs[1])
+        else:
+            bblon2 = bblon1
         # end if
-        # ----------
-        stmp = xlipd.extract_string1(LTab['columns'][x_col_1], 'startYear', False, 'NA')
-        if is_number(stmp): stmp = str(int(float(stmp)))
-        tpara.append(Paragraph('Start Year: ' + stmp + ' CE', pstyle))
-        # ----------
-        stmp = xlipd.extract_string1(LTab['columns'][x_col_1], 'endYear', False, 'NA')
-        if is_number(stmp): stmp = str(int(float(stmp)))
-        tpara.append(Paragraph('End Year: ' + stmp + ' CE', pstyle))
-        # ---Table-------
-        tdata = [[tpara]]
-        t = Table(tdata, colWidths=twidth, rowHeights=theight, style=tstyle)
-        t.wrapOn(c, twidth, theight)
-        t.drawOn(c, i_xloc + 1.0*cm + twidth, i_yloc + i_height - 1.7*cm - theight)
-
-
-        # ---Time Series Graph-------------------------------------------------
-
-        # Replace data values of "-999" within tolerance with NaN:
-        x_df.loc[abs(x_df[x_col_2] + 999.0) < 0.001, x_col_2] = np.nan
-
-        # Get axis labels:
-        stmp = xlipd.extract_string1(LTab['columns'][x_col_1], 'variableName', False, 'NA')
-        stmp1 = xlipd.extract_string1(LTab['columns'][x_col_1], 'units', False, 'NA')
-        if stmp1.strip().upper() in ['UNITLESS', 'NA']: stmp1 = '-'
-        x_label = stmp + ' (' + stmp1 + ')'
-        # ----------
-        stmp = xlipd.extract_string1(LTab['columns'][x_col_2], 'variableName', False, 'NA')
-        if x_interp:
-            stmp1 = xlipd.extract_string1(LTab['columns'][x_col_2]['interpretationFormat'], 'format', False, 'NA')
+        bblat1 = float(bbstrs[2])
+        if is_number(bbstrs[3]):
+            bblat2 = float(bbstrs[3])
         else:
-            stmp1 = xlipd.extract_string1(LTab['columns'][x_col_2], 'units', False, 'NA')
+            bblat2 = bblat1
         # end if
-        if stmp1.strip().upper() in ['UNITLESS', 'NA']: stmp1 = '-'
-        y_label = stmp + ' (' + stmp1 + ')'
-        y_label = textwrap.fill(y_label, 40)
-
-        # Make graph:
-        fig = plt.figure(figsize=(12, 6))
-        plt.xlabel(x_label, fontsize=14, fontweight='bold', wrap=True)
-        plt.ylabel(y_label, fontsize=14, fontweight='bold', wrap=True)
-        if x_type == 'PROXY':
-            if x_interp:
-                ymin = min(-3.0, min(x_df.iloc[:,x_col_2])) * 1.05
-                ymax = max( 3.0, max(x_df.iloc[:,x_col_2])) * 1.05
-                plt.ylim([ymin, ymax])
-                plt.axhline(0.0, color='grey', linewidth=0.5, zorder=1)
-                plt.bar(x_df.iloc[:,x_col_1], x_df.iloc[:,x_col_2], 
-                        width=1.0, color=source_fc, linewidth=0.5,
-                        edgecolor=source_ec, zorder=2)
-            else:
-                plt.plot(x_df.iloc[:,x_col_1], x_df.iloc[:,x_col_2], 
-                         color=source_lc, linewidth=0.5,
-                         marker='o', markersize=5.0, markerfacecolor=source_fc,
-                         markeredgecolor=source_ec, markeredgewidth=1.0)
+        if (bblon1 < 0.0): bblon1 += 360.0  # Deal with +/-180 degrees
+        if (bblon2 < 0.0): bblon2 += 360.0  # Deal with +/-180 degrees
+        if abs(bblon2-bblon1) > 1.0 and abs(bblat2-bblat1) > 1.0:
+            plon, plat = ax.projection.proj4_params['lon_0'], ax.projection.proj4_params['lat_0']
+            xy = project_polygon([bblon1, bblon2, bblon2, bblon1],  # Anticlockwise from bottom left
+                                 [bblat1, bblat1, bblat2, bblat2], plon, plat, tolerance)
+            if xy is not None:
+                ax.add_patch(mpatches.Polygon(xy * ax.projection.globe.semimajor_axis,
+                                              closed=True, fill=True,
+                                              fc=pc, ec=ec, lw=1.0))
+                num_vertices = len(xy)
             # end if
         else:
-            if x_interp:
-                ymin = min(-3.0, min(x_df.iloc[:,x_col_2])) * 1.05
-                ymax = max( 3.0, max(x_df.iloc[:,x_col_2])) * 1.05
-                plt.ylim([ymin, ymax])
-                plt.axhline(0.0, color='grey', linewidth=0.5, zorder=1)
-                plt.bar(x_df.iloc[:,x_col_1], x_df.iloc[:,x_col_2], 
-                        width=1.0, color=target_fc, linewidth=0.5,
-                        edgecolor=target_ec, zorder=2)
-            else:
-                plt.plot(x_df.iloc[:,x_col_1], x_df.iloc[:,x_col_2], 
-                         color=target_lc, linewidth=0.5,
-                         marker='o', markersize=5.0, markerfacecolor=target_fc,
-                         markeredgecolor=target_ec, markeredgewidth=1.0)
-            # end if
+            plt.scatter(bblon1, bblat1, marker=marker, s=50,
+                        c=np.atleast_2d(pc), ec=ec, lw=1.0,
+                        transform=ccrs.PlateCarree())
+            num_vertices = 1
         # end if
+    # end if
+    return num_vertices
 
-        # Show graph:
-        #plt.show()
-     
-        # Put graph on PDF as PNG:
-        # imgdata = io.BytesIO()
-        # fig.savefig(imgdata, dpi=fig_dpi, format='png', bbox_inches='tight')
-        # imgdata.seek(0)  # rewind the data
-        # imgreader = ImageReader(imgdata)
-        # c.drawImage(imgreader, i_xloc+0.5*cm, i_yloc+0.5*cm, 12*cm, 6*cm)
-
-        # Put graph on PDF as SVG:
-        svg_file = io.BytesIO()
-        fig.savefig(svg_file, format='svg', bbox_inches='tight')
-        svg_file.seek(0)  # rewind the data
-        drawing = svg2rlg(svg_file)
-        scaled_drawing = resize_drawing(drawing, 'height', 6*cm)    
-        renderPDF.draw(scaled_drawing, c, i_xloc+0.5*cm, i_yloc+0.5*cm)
-
-        # Close graph:
-        plt.close()
+# end def
 
-    
-        # ---Locality Map------------------------------------------------------
 
-        # Get coordinates:
-        plon = LMeta['geo']['geometry']['coordinates'][0]
-        plat = LMeta['geo']['geometry']['coordinates'][1]
-        proj = ccrs.Orthographic(central_longitude=plon, central_latitude=plat)
-        proj._threshold /= 100.0  # To make geodesic lines smoother
 
-        # Create map:
-        fig = plt.figure(figsize=(5, 5))
-        ax = plt.axes(projection=proj)
-    
-        # Add coastlines and grid:
-        ax.coastlines(resolution='110m', zorder=1)
-        ax.gridlines(zorder=1)
-        ax.set_global()
-    
-        # Add location point:
-        # plt.scatter(plon, plat, s=50, c=(0.0,0.0,1.0,0.35), marker='o',
-        #             edgecolors='blue', linewidths=1,
-        #             transform=proj)
-        #             #transform=ccrs.PlateCarree())
-    
-        # Add bounding box or circle with user-defined radius:
-        # proj = ccrs.Orthographic(central_longitude=plon, central_latitude=plat)
-        # r_ortho = compute_radius(plon, plat, proj, bbox_dx/2)
-        # ax.add_patch(mpatches.Circle(xy=[plon, plat],
-        #                                 radius=r_ortho,
-        #                                 facecolor=(0.0,0.0,1.0,0.15),
-        #                                 edgecolor='blue', linewidth=1,
-        #                                 transform=proj))
-        # ax.add_patch(mpatches.Rectangle(xy=[plon-r_ortho, plat-r_ortho],
-        #                                 width=2*r_ortho, height=2*r_ortho,
-        #                                 facecolor=(0.0,0.0,1.0,0.15), 
-        #                                 edgecolor='blue', linewidth=1,
-        #                                 transform=proj))
-
-        # Add target bounding box or point:
-        bbstr = LMeta['geo']['detailedCoordinates']['target']['values']
-        if bbstr is None: bbstr = 'NA,NA,NA,NA,NA'
-        bbstrs = [x for x in bbstr.split(',')]
-        if is_number(bbstrs[0]):
-            bblon1 = float(bbstrs[0])
-            if is_number(bbstrs[1]):
-                bblon2 = float(bbstrs[1])
-            else:
-                bblon2 = bblon1
-            # end if
-            bblat1 = float(bbstrs[2])
-            if is_number(bbstrs[3]):
-                bblat2 = float(bbstrs[3])
-            else:
-                bblat2 = bblat1
-            # end if
-            if (bblon1 < 0.0): bblon1 += 360.0  # Deal with +/-180 degrees
-            if (bblon2 < 0.0): bblon2 += 360.0  # Deal with +/-180 degrees
-            if abs(bblon2-bblon1) > 1.0 and abs(bblat2-bblat1) > 1.0:
-                poly_corners = np.zeros((4, 2), np.float64)
-                poly_corners[:,0] = [bblon1, bblon2, bblon2, bblon1]  # Anticlockwise from bottom left
-                poly_corners[:,1] = [bblat1, bblat1, bblat2, bblat2]
-                p = shapely.geometry.Polygon(poly_corners)
-                if p.exterior.is_ccw == False:
-                    poly_corners = np.flip(poly_corners, axis=0)  # Fix polygon orientation 
-                ax.add_patch(mpatches.Polygon(poly_corners, closed=True, fill=True,
-                                              fc=target_pc, ec=target_ec, lw=1.0,
-                                              transform=ccrs.Geodetic()))
-            else:
-                plt.scatter(bblon1, bblat1, marker='D', s=50,
-                            c=np.atleast_2d(target_pc), ec=target_ec, lw=1.0,
-                            transform=ccrs.PlateCarree())
-            # end if
-        # end if
 
-        # Add source bounding box or point:
-        bbstr = LMeta['geo']['detailedCoordinates']['source']['values']
-        if bbstr is None: bbstr = 'NA,NA,NA,NA,NA'
-        bbstrs = [x for x in bbstr.split(',')]
-        if is_number(bbstrs[0]):
-            bblon1 = float(bbstrs[0])
-            if is_number(bbstrs[1]):
-                bblon2 = float(bbstrs[1])
-            else:
-                bblon2 = bblon1
-            # end if
-            bblat1 = float(bbstrs[2])
-            if is_number(bbstrs[3]):
-                bblat2 = float(bbstrs[3])
-            else:
-                bblat2 = bblat1
-            # end if
-            if (bblon1 < 0.0): bblon1 += 360.0  # Deal with +/-180 degrees
-            if (bblon2 < 0.0): bblon2 += 360.0  # Deal with +/-180 degrees
-            if abs(bblon2-bblon1) > 1.0 and abs(bblat2-bblat1) > 1.0:
-                poly_corners = np.zeros((4, 2), np.float64)
-                poly_corners[:,0] = [bblon1, bblon2, bblon2, bblon1]  # Anticlockwise from bottom left
-                poly_corners[:,1] = [bblat1, bblat1, bblat2, bblat2]
-                p = shapely.geometry.Polygon(poly_corners)
-                if p.exterior.is_ccw == False:
-                    poly_corners = np.flip(poly_corners, axis=0)  # Fix polygon orientation 
-                ax.add_patch(mpatches.Polygon(poly_corners, closed=True, fill=True,
-                                              fc=source_pc, ec=source_ec, lw=1.0, 
-                                              transform=ccrs.Geodetic()))
-            else:
-                plt.scatter(bblon1, bblat1, marker='s', s=50, 
-                            c=np.atleast_2d(source_pc), ec=source_ec, lw=1.0,
-                            transform=ccrs.PlateCarree())
-            # end if
-        # end if
+#------------------------------------------------------------------------------
+# Orthographic projection onto the unit sphere (batched)
+#   - Returns (n, 3) array: X east, Y north (projected map coordinates for a
+#     unit globe) and Z towards the viewer (Z >= 0 is visible).
+#   - Same as ccrs.Orthographic (spherical) scaled by the globe radius.
+#------------------------------------------------------------------------------
+def ortho_xyz(lon, lat, plon, plat):
 
-        # plt.scatter(plon, plat, marker='s', s=50, 
-        #             c=np.atleast_2d(source_pc), ec=source_ec, lw=1.0,
-        #             transform=ccrs.PlateCarree())
+    import numpy as np
 
+    lam = np.radians(np.asarray(lon, np.float64) - plon)
+    phi = np.radians(np.asarray(lat, np.float64))
+    phi0 = np.radians(plat)
+    X = np.cos(phi) * np.sin(lam)
+    Y = np.cos(phi0) * np.sin(phi) - np.sin(phi0) * np.cos(phi) * np.cos(lam)
+    Z = np.sin(phi0) * np.sin(phi) + np.cos(phi0) * np.cos(phi) * np.cos(lam)
+    return np.column_stack([X, Y, Z])
 
-        # Add custom legend:
-        if map_legend_flag:
-            legend_elements = [Line2D([0], [0], marker='s', label='Source',
-                                      c=source_ec, lw=1.0,
-                                      mfc=source_fc, mec=source_ec, mew=1.0),
-                               Line2D([0], [0], marker='D', label='Target',
-                                      c=target_ec, lw=1.0,
-                                      mfc=target_fc, mec=target_ec, mew=1.0)]
-            ax.legend(handles=legend_elements, loc='upper right')
-        # end if
+# end def
 
-        # Show graph:
-        # plt.show()
-    
-        # Put map on PDF as PNG:
-        # imgdata = io.BytesIO()
-        # fig.savefig(imgdata, dpi=fig_dpi, format='png', bbox_inches='tight')
-        # imgdata.seek(0)  # rewind the data
-        # imgreader = ImageReader(imgdata)
-        # c.drawImage(imgreader, i_xloc + 13.25*cm, i_yloc + 1.25*cm, 5*cm, 5*cm)
-
-        # Put graph on PDF as SVG:
-        svg_file = io.BytesIO()
-        fig.savefig(svg_file, format='svg', bbox_inches='tight')
-        svg_file.seek(0)  # rewind the data
-        drawing = svg2rlg(svg_file)
-        scaled_drawing = resize_drawing(drawing, 'height', 5*cm)    
-        renderPDF.draw(scaled_drawing, c, i_xloc + 13.25*cm, i_yloc + 1.25*cm)
-
-        # Close graph:
-        plt.close()
-
-        #----------------------------------------------------------------------
-        
+
+
+
+#------------------------------------------------------------------------------
+# Points where great circle segments a-b cross the limb (Z = 0)
+#   - a, b are (n, 3) arrays from ortho_xyz; returns (n, 3) array.
+#------------------------------------------------------------------------------
+def limb_crossings(a, b):
+
+    import numpy as np
+
+    t = a[:,2] / (a[:,2] - b[:,2])
+    c = a + t[:,None] * (b - a)
+    c[:,2] = 0.0
+    r = np.hypot(c[:,0], c[:,1])
+    r[r == 0.0] = 1.0
+    c[:,:2] /= r[:,None]
+    return c
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Project lines onto the map, clip to the visible hemisphere and simplify
+#   - lon, lat, ids: vertex arrays and line id of each vertex.
+#   - Returns list of (n, 2) arrays on the unit globe (one per visible run),
+#     simplified with tolerance (0 = none).
+#------------------------------------------------------------------------------
+def project_lines(lon, lat, ids, plon, plat, tolerance=0.0):
+
+    import numpy as np
+    import shapely
+
+    P = ortho_xyz(lon, lat, plon, plat)
+    vis = P[:,2] >= 0.0
+
+    # Limb crossings between consecutive vertices of the same line:
+    same = ids[1:] == ids[:-1]
+    cross = np.nonzero(same & (vis[1:] != vis[:-1]))[0]
+    C = limb_crossings(P[cross], P[cross+1])
+
+    # Visible vertices (key 2i) and crossings (key 2i+1) in line order.
+    # Runs start at the first vertex of a line or where a line comes into view:
+    first = np.ones(len(P), bool)
+    first[1:] = ~same
+    vi = np.nonzero(vis)[0]
+    keys = np.concatenate([2*vi, 2*cross + 1])
+    order = np.argsort(keys, kind='stable')
+    xy = np.concatenate([P[vi,:2], C[:,:2]])[order]
+    start = np.concatenate([first[vi], ~vis[cross]])[order]
+    run = np.cumsum(start) - 1
+
+    # Drop single points, then simplify all runs at once:
+    keep = np.bincount(run + 1)[run + 1] >= 2
+    if not np.any(keep): return []
+    run = np.unique(run[keep], return_inverse=True)[1]
+    lines = shapely.linestrings(xy[keep], indices=run)
+    if tolerance > 0.0:
+        lines = shapely.simplify(lines, tolerance, preserve_topology=False)
+    # end if
+    coords, index = shapely.get_coordinates(lines, return_index=True)
+    return np.split(coords, np.nonzero(np.diff(index))[0] + 1)
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Project polygon with great circle edges onto the map
+#   - Edges are densified every MAP_DENSIFY degrees.  Hidden parts are
+#     clipped to the limb (hidden vertices pushed out to the limb).
+#   - Returns (n, 2) array on the unit globe simplified with tolerance
+#     (0 = none), or None if the polygon is not visible.
+#------------------------------------------------------------------------------
+def project_polygon(lon, lat, plon, plat, tolerance=0.0):
+
+    import numpy as np
+    import shapely
+
+    # Densify edges along great circles:
+    P = ortho_xyz(lon, lat, plon, plat)
+    ring = []
+    for i in range(len(P)):
+        a, b = P[i], P[(i+1) % len(P)]
+        angle = np.degrees(np.arccos(np.clip(np.dot(a, b), -1.0, 1.0)))
+        t = np.linspace(0.0, 1.0, max(1, int(np.ceil(angle / MAP_DENSIFY))), endpoint=False)
+        edge = a + t[:,None] * (b - a)
+        ring.append(edge / np.linalg.norm(edge, axis=1)[:,None])
     # end for
+    ring = np.concatenate(ring)
+    if not np.any(ring[:,2] > 0.0): return None
+
+    # Insert limb crossings and push hidden vertices out to the limb:
+    nxt = np.roll(ring, -1, axis=0)
+    cross = np.nonzero((ring[:,2] >= 0.0) != (nxt[:,2] >= 0.0))[0]
+    keys = np.concatenate([2*np.arange(len(ring)), 2*cross + 1])
+    pts = np.concatenate([ring, limb_crossings(ring[cross], nxt[cross])])
+    pts = pts[np.argsort(keys, kind='stable')]
+    hidden = pts[:,2] < 0.0
+    r = np.hypot(pts[hidden,0], pts[hidden,1])
+    r[r == 0.0] = 1.0
+    pts[hidden,:2] /= r[:,None]
+
+    # Simplify:
+    poly = shapely.Polygon(pts[:,:2])
+    if tolerance > 0.0: poly = poly.simplify(tolerance)
+    if poly.is_empty or poly.area == 0.0: return None
+    return np.asarray(poly.exterior.coords)
 
-    # Save pdf:
-    c.save()
-    
-    # Clean up:
-    del x_df
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Natural Earth 110m coastlines and gridlines as (lon, lat, line id) arrays
+#   - Read once per process.
+#   - Gridlines are those of ax.gridlines() on a global map (meridians every
+#     60 degrees, parallels every 20 degrees), sampled every degree.
+#------------------------------------------------------------------------------
+def coastline_lonlat():
+    global COASTLINE_LONLAT
+
+    import shapely
+    import cartopy.feature as cfeature
+
+    if COASTLINE_LONLAT is None:
+        geoms = shapely.get_parts(list(cfeature.NaturalEarthFeature(
+            'physical', 'coastline', '110m').geometries()))
+        coords, ids = shapely.get_coordinates(geoms, return_index=True)
+        COASTLINE_LONLAT = (coords[:,0], coords[:,1], ids)
+    # end if
+    return COASTLINE_LONLAT
+
+# end def
+
+
+def graticule_lonlat():
+    global GRATICULE_LONLAT
+
+    import numpy as np
+
+    if GRATICULE_LONLAT is None:
+        lon, lat, ids = [], [], []
+        for i, mlon in enumerate(np.arange(-180.0, 180.0, 60.0)):
+            mlat = np.arange(-90.0, 91.0, 1.0)
+            lon.append(np.full(len(mlat), mlon)); lat.append(mlat); ids.append(np.full(len(mlat), i))
+        # end for
+        for i, plat in enumerate(np.arange(-80.0, 81.0, 20.0)):
+            plon = np.arange(-180.0, 181.0, 1.0)
+            lon.append(plon); lat.append(np.full(len(plon), plat)); ids.append(np.full(len(plon), 100 + i))
+        # end for
+        GRATICULE_LONLAT = (np.concatenate(lon), np.concatenate(lat), np.concatenate(ids))
+    # end if
+    return GRATICULE_LONLAT
 
 # end def
 
 
 
 
+#------------------------------------------------------------------------------
+# Convert matplotlib figure to scaled ReportLab drawing (via SVG)
+#------------------------------------------------------------------------------
+def figure_to_drawing(fig, resize_type, resize_value):
+    return svg_to_drawing(figure_to_svg(fig), resize_type, resize_value)
+# end def
+
+
+def figure_to_svg(fig, bbox_inches='tight'):
+    import matplotlib
+    # Same figure always gives the same SVG (fixed element IDs, no date):
+    svg_file = io.BytesIO()
+    with matplotlib.rc_context({'svg.hashsalt': 'LiPD'}):
+        fig.savefig(svg_file, format='svg', bbox_inches=bbox_inches, metadata={'Date': None})
+    # end with
+    return svg_file.getvalue()
+# end def
+
+
+def svg_to_drawing(svg, resize_type, resize_value):
+    from svglib.svglib import svg2rlg
+    drawing = svg2rlg(io.BytesIO(svg))
+    return resize_drawing(drawing, resize_type, resize_value)
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Convert raster chart (see make_chart_image) to ReportLab drawing
+#   - Image of CHART_IMAGE_SIZE with the x label underneath.
+#------------------------------------------------------------------------------
+def image_to_drawing(image, x_label):
+    from reportlab.graphics.shapes import Drawing, Image, String
+    width, height = CHART_IMAGE_SIZE
+    drawing = Drawing(width, height + 0.5*cm)
+    drawing.add(Image(0, 0.5*cm, width, height, image))
+    drawing.add(String(width / 2.0, 0.1*cm, trim_string(x_label, 'Helvetica-Bold', 8, width),
+                       fontName='Helvetica-Bold', fontSize=8, textAnchor='middle'))
+    return drawing
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Convert map figure to two SVG layers with the same bounding box
+#   - base: background, coastlines and gridlines (base_artists), which are
+#     the same for all maps with the same centre.
+#   - overlay: everything else (boxes, outline, legend) on a transparent
+#     background, drawn over the base.
+#------------------------------------------------------------------------------
+def figure_to_svg_layers(fig, base_artists):
+
+    import matplotlib
+
+    # Bounding box of the whole map (as bbox_inches='tight'):
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer())
+    bbox = bbox.padded(matplotlib.rcParams['savefig.pad_inches'])
+
+    # Save each layer with the other layer hidden:
+    ax = fig.axes[0]
+    base = list(base_artists) + [fig.patch, ax.patch]
+    overlay = [i for i in ax.get_children() if not i in base and i.get_visible()]
+    svgs = []
+    for hidden in [overlay, base]:
+        try:
+            for i in hidden: i.set_visible(False)
+            svgs.append(figure_to_svg(fig, bbox))
+        finally:
+            for i in hidden: i.set_visible(True)
+        # end try
+    # end for
+    return svgs
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Draw a DashboardPanel onto a canvas
+#   - (i_xloc, i_yloc) is the bottom left corner of the panel.
+#   - shared: store repeated content as shared forms (see draw_shared).
+#   - compression: the canvas pageCompression (for form statistics).
+#------------------------------------------------------------------------------
+def draw_panel(c, panel, i_xloc, i_yloc, i_width=PANEL_WIDTH, i_height=PANEL_HEIGHT,
+               shared=True, compression=PDF_COMPRESSION):
+
+    from reportlab.platypus import Table, TableStyle
+    #from reportlab.lib import colors
+    from reportlab.graphics import renderPDF
+
+    # Draw bounding rectangle:
+    draw_shared(c, 'rect %r %r' % (i_width, i_height),
+                lambda c: c.rect(0, 0, i_width, i_height, stroke=1, fill=0),
+                i_xloc, i_yloc, shared, compression)
+
+    # ---Data Information--------------------------------------------------
+
+    # Write dataset_name:
+    stmp = 'Dataset Name: ' + panel.fields['dataset_name']
+    stmp = trim_string(stmp, 'Helvetica-Bold', 12, PAGE_WIDTH - 3.0*cm)
+    c.setFont('Helvetica-Bold', 12)
+    c.drawString(i_xloc + 0.5*cm, i_yloc + i_height - 0.7*cm, stmp)
+
+    # Write dataset_id and reference_id:
+    c.setFont('Helvetica', 10)
+    c.drawString(i_xloc + 0.5*cm, i_yloc + i_height - 1.2*cm,
+                 'Dataset ID: ' + panel.fields['dataset_id'] +
+                 '; Reference ID: ' + panel.fields['reference_id'])
+
+    # Set up table style:
+    twidth = (PAGE_WIDTH - 3.5*cm) / 2.0
+    theight = 5.0*cm
+    tstyle = TableStyle([('VALIGN', (0,0), (0,0), 'TOP'),
+                         #('BOX', (0,0), (0,0), 0.5, colors.red),
+                         ('LEFTPADDING', (0,0), (0,0), 0),
+                         ('RIGHTPADDING', (0,0), (0,0), 0),
+                         ('TOPPADDING', (0,0), (0,0), 0),
+                         ('BOTTOMPADDING', (0,0), (0,0), 0)])
+
+    # Write metadata in column 1:
+    t = Table([[panel.para1]], colWidths=twidth, rowHeights=theight, style=tstyle)
+    t.wrapOn(c, twidth, theight)
+    t.drawOn(c, i_xloc + 0.5*cm, i_yloc + i_height - 1.7*cm - theight)
+
+    # Write metadata in column 2:
+    t = Table([[panel.para2]], colWidths=twidth, rowHeights=theight, style=tstyle)
+    t.wrapOn(c, twidth, theight)
+    t.drawOn(c, i_xloc + 1.0*cm + twidth, i_yloc + i_height - 1.7*cm - theight)
+
+    # ---Time Series Graph-------------------------------------------------
+    drawing = panel.chart_drawing
+    draw_shared(c, 'chart ' + panel.chart_key,
+                lambda c: renderPDF.draw(drawing, c, 0, 0),
+                i_xloc+0.5*cm, i_yloc+0.5*cm, shared, compression)
+
+    # ---Locality Map------------------------------------------------------
+    for drawing, key in zip(panel.map_drawing, panel.map_keys):
+        draw_shared(c, 'map ' + key,
+                    lambda c: renderPDF.draw(drawing, c, 0, 0),
+                    i_xloc + 13.25*cm, i_yloc + 1.25*cm, shared, compression)
+    # end for
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Write "Created" date header
+#   - (x, y) is the right end of the text baseline.
+#------------------------------------------------------------------------------
+def draw_created(c, created, x, y, shared=True, compression=PDF_COMPRESSION):
+
+    def draw(c):
+        c.setFont('Helvetica-Oblique', 9)
+        c.drawRightString(0, 0, created)
+    # end def
+
+    draw_shared(c, 'created ' + created, draw, x, y, shared, compression)
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Draw content once per PDF as a shared form XObject
+#   - key identifies the content (e.g. an SVG hash); the form is named by
+#     its hash, so identical content anywhere in the PDF is stored once and
+#     then only referenced (counted in form_stats).
+#   - draw_function(c) draws the content about the origin; it is placed
+#     with its origin at (x, y).
+#   - shared=False draws the content directly (PDFs with nothing to reuse).
+#   - compression is the canvas pageCompression; form sizes for the
+#     statistics are estimated from the uncompressed form content.
+#------------------------------------------------------------------------------
+def draw_shared(c, key, draw_function, x=0.0, y=0.0, shared=True,
+                compression=PDF_COMPRESSION):
+
+    import zlib
+
+    if not shared:
+        c.saveState()
+        c.translate(x, y)
+        draw_function(c)
+        c.restoreState()
+        return
+    # end if
+
+    name = 'Shared_' + hashlib.md5(key.encode('utf-8')).hexdigest()
+    form_stats['uses'] += 1
+    if c.hasForm(name):
+        form_stats['hits'] += 1
+        form_stats['bytes_saved'] += form_sizes.get(name, 0)
+    else:
+        c.beginForm(name, -PAGE_WIDTH, -PAGE_HEIGHT, PAGE_WIDTH, PAGE_HEIGHT)
+        draw_function(c)
+        stream = c.getCurrentPageContent().encode('utf-8')  # Form content
+        form_sizes[name] = len(zlib.compress(stream)) if compression else len(stream)
+        c.endForm(Resources=form_resources(c))
+    # end if
+    c.saveState()
+    c.translate(x, y)
+    c.doForm(name)
+    c.restoreState()
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Resources for a form XObject (fonts, procedures and transparency states)
+#   - ReportLab (checked with 5.0.1) leaves the transparency states
+#     (ExtGState) out of form resources, so alpha colours in a form fail
+#     to render.  They are copied from the canvas here, which reads the
+#     private Canvas._extgstate: re-check when upgrading ReportLab.
+#------------------------------------------------------------------------------
+def form_resources(c):
+
+    from reportlab.pdfbase import pdfdoc
+
+    resources = pdfdoc.PDFResourceDictionary()
+    resources.basicFonts()
+    resources.basicProcs()
+    resources.ExtGState = c._extgstate.getState()
+    return resources
+
+# end def
+
+
+
+
+#------------------------------------------------------------------------------
+# Output sink: combined book
+#   - Two panels per page with date header and page numbers.
+#   - "Page N of M" is drawn as a form per page that is defined in end(),
+#     so the number of panels isn't needed in advance (a data source is
+#     read only once, even a compressed tar bundle).
+#   - Written to "<pdf_file>.tmp" and renamed over pdf_file when complete
+#     (abort() removes the temporary file after an error).
+#------------------------------------------------------------------------------
+class BookSink:
+
+    def __init__(self, pdf_file, compression=PDF_COMPRESSION):
+        self.pdf_file = pdf_file
+        self.compression = compression
+    # end def
+
+    def begin(self):
+        from reportlab.pdfgen import canvas
+        # Open up a new PDF canvas (temporary file, renamed when saved):
+        self.c = canvas.Canvas(self.pdf_file + '.tmp', pagesize=A4,
+                               pageCompression=self.compression)
+        self.created = 'Created: ' + dt.datetime.now().strftime('%d-%b-%G')
+        self.page = 0  # Page counter
+        self.item_top = True  # True if is item top of page (two items per page)
+    # end def
+
+    def add(self, panel):
+        c = self.c
+
+        # Deal with top or bottom page items:
+        if self.item_top:
+            self.page += 1
+            if self.page > 1: c.showPage()
+            i_yloc = PAGE_HEIGHT/2 + 0.5*cm
+            # Write date:
+            draw_created(c, self.created, PAGE_WIDTH - 1.0*cm, PAGE_HEIGHT - 0.6*cm,
+                         compression=self.compression)
+            # Write page number (form defined in end()):
+            c.doForm('PageNumber' + str(self.page))
+        else:
+            i_yloc = 1*cm
+        # end if
+        self.item_top = not self.item_top
+
+        draw_panel(c, panel, 1*cm, i_yloc, compression=self.compression)
+    # end def
+
+    def end(self):
+        c = self.c
+        # Define page numbers, now the number of pages is known:
+        for page in range(1, self.page + 1):
+            c.beginForm('PageNumber' + str(page))
+            c.setFont('Helvetica', 9)
+            c.drawCentredString(PAGE_WIDTH / 2.0,  0.4*cm,
+                                'Page ' + str(page) + ' of ' + str(self.page))
+            c.endForm()
+        # end for
+        # Save pdf (replace book in one step, so readers never see a partial file):
+        c.save()
+        os.replace(self.pdf_file + '.tmp', self.pdf_file)
+    # end def
+
+    def abort(self):
+        # Remove partial book (pdf_file is left as it was):
+        try:
+            os.remove(self.pdf_file + '.tmp')
+        except OSError:
+            pass
+        # end try
+    # end def
+
+# end class
+
+
+
+
+#------------------------------------------------------------------------------
+# Output sink: one standalone PDF per dataset
+#   - Half A4 page holding a single panel with date header.
+#------------------------------------------------------------------------------
+class DatasetPDFSink:
+
+    def __init__(self, out_dir, compression=PDF_COMPRESSION):
+        self.out_dir = out_dir
+        self.compression = compression
+    # end def
+
+    def begin(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.created = 'Created: ' + dt.datetime.now().strftime('%d-%b-%G')
+    # end def
+
+    def add(self, panel):
+        from reportlab.pdfgen import canvas
+        pagesize = (PAGE_WIDTH, PAGE_HEIGHT/2)
+        c = canvas.Canvas(output_name(self.out_dir, panel, '.pdf'), pagesize=pagesize,
+                          pageCompression=self.compression)
+        # Single panel, so nothing to share:
+        draw_created(c, self.created, PAGE_WIDTH - 1.0*cm, pagesize[1] - 0.6*cm, False)
+        draw_panel(c, panel, 1*cm, 0.5*cm, shared=False)
+        c.save()
+    # end def
+
+    def end(self):
+        pass
+    # end def
+
+# end class
+
+
+
+
+#------------------------------------------------------------------------------
+# Output sink: PNG thumbnail per dataset
+#   - Chart and map side by side, rasterised from the panel figures.
+#------------------------------------------------------------------------------
+class ThumbnailSink:
+
+    def __init__(self, out_dir, dpi=30):
+        self.out_dir = out_dir
+        self.dpi = dpi
+    # end def
+
+    def begin(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+    # end def
+
+    def add(self, panel):
+        from PIL import Image  # Installed with matplotlib
+        images = []
+        for fig in [panel.chart_fig, panel.map_fig]:
+            if fig is None: continue  # Draft quality (raster chart, no map)
+            png_file = io.BytesIO()
+            fig.savefig(png_file, dpi=self.dpi, format='png', bbox_inches='tight')
+            png_file.seek(0)  # rewind the data
+            images.append(Image.open(png_file).convert('RGB'))
+        # end for
+        if panel.chart_image is not None: images.insert(0, panel.chart_image)
+        width = sum([i.width for i in images])
+        height = max([i.height for i in images])
+        thumb = Image.new('RGB', (width, height), 'white')
+        x = 0
+        for i in images:
+            thumb.paste(i, (x, (height - i.height) // 2))
+            x += i.width
+        # end for
+        thumb.save(output_name(self.out_dir, panel, '.png'))
+    # end def
+
+    def end(self):
+        pass
+    # end def
+
+# end class
+
+
+
+
+#------------------------------------------------------------------------------
+# Output sink: JSON sidecar of the extracted fields per dataset
+#------------------------------------------------------------------------------
+class JSONSink:
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+    # end def
+
+    def begin(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+    # end def
+
+    def add(self, panel):
+        with open(output_name(self.out_dir, panel, '.json'), 'w') as f:
+            json.dump(panel.fields, f, indent=2)
+        # end with
+    # end def
+
+    def end(self):
+        pass
+    # end def
+
+# end class
+
+
+
+
+#------------------------------------------------------------------------------
+# Output file name for a panel (LiPD file name with new extension)
+#------------------------------------------------------------------------------
+def output_name(out_dir, panel, ext):
+    return os.path.join(out_dir, os.path.splitext(os.path.basename(panel.name))[0] + ext)
+# end def
+
+
+
+
 #------------------------------------------------------------------------------
 # Computes the radius in orthographic coordinates
 #   https://stackoverflow.com/questions/52105543/drawing-circles-with-cartopy-in-orthographic-projection/52117339
 #------------------------------------------------------------------------------
 def compute_radius(lon, lat, ortho, radius_degrees):
+    import cartopy.crs as ccrs
     if lat <= 0:
         phi1 = lat + radius_degrees
     else:
@@ -664,6 +1922,8 @@ def resize_drawing(drawing, resize_type='scale', resize_value=1.0):
 # Trim string to fit within width (ReportLab drawString)
 #------------------------------------------------------------------------------
 def trim_string(string, fontName, fontSize, maxWidth):
+
+    from reportlab.pdfbase.pdfmetrics import stringWidth
     
     if stringWidth(string, fontName, fontSize) > maxWidth:
         string = string + '...'